@@ -0,0 +1,149 @@
+# async_requests.py
+# Асинхронные версии запросов из requests.py для хендлеров aiogram (async-движок на aiosqlite).
+# Синхронные функции в requests.py остаются для планировщика и потоков экспорта.
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, func, and_
+
+from app.database.models import MotivationalPhrases, MotivationalEngPhrases, UserInfo
+from app.database.engine import AsyncSession
+from app.database.requests import names_table, build_user_day_upsert, format_duration, get_report_day
+
+
+async def get_random_phrase():
+    """
+    Получить случайную мотивационную фразу из базы данных.
+
+    Returns:
+        str: Мотивационная фраза или сообщение о том, что фразы отсутствуют.
+    """
+    async with AsyncSession() as session:
+        phrase = (await session.execute(
+            select(MotivationalPhrases.phrase).order_by(func.random()).limit(1)
+        )).scalar()
+    if phrase is None:
+        return "Нет мотивационных фраз в базе данных."
+    return phrase
+
+
+async def get_eng_random_phrase():
+    """
+    Получить случайную мотивационную фразу (en) из базы данных.
+
+    Returns:
+        str: Мотивационная фраза или сообщение о том, что фразы отсутствуют.
+    """
+    async with AsyncSession() as session:
+        phrase = (await session.execute(
+            select(MotivationalEngPhrases.phrase).order_by(func.random()).limit(1)
+        )).scalar()
+    if phrase is None:
+        return "Нет мотивационных фраз в базе данных."
+    return phrase
+
+
+async def add_user_info(user_id, start_time, started=False):
+    try:
+        async with AsyncSession() as session:
+            today = start_time.date()
+            await session.execute(build_user_day_upsert(
+                user_id, today, date=start_time, start_time=start_time, started=started
+            ))
+            await session.commit()
+            logging.info(f"Upserted UserInfo start_time for user_id: {user_id}, date={today}")
+    except Exception as e:
+        logging.error(f"Failed to add or update UserInfo: {e}")
+
+
+async def end_work(user_id, end_time):
+    logging.info(f'end_work(user_id={user_id}, end_time={end_time}) запущен.')
+    async with AsyncSession() as session:
+        today = end_time.date()
+        user = (await session.execute(
+            select(UserInfo).where(and_(
+                UserInfo.user_id == user_id,
+                UserInfo.end_time.is_(None),
+                UserInfo.start_time.is_not(None),
+                UserInfo.day == today
+            ))
+        )).scalars().first()
+        if not user:
+            logging.info(f"Нет незавершённых записей для user_id={user_id} за {today}")
+            return "Пользователь не найден или работа уже завершена.", ""
+
+        user.end_time = end_time
+        await session.commit()
+        logging.info(f"End time успешно записан для user_id={user_id}")
+
+        daily_str = format_duration(end_time - user.start_time)
+
+        # Суммируем всё время и лиды
+        records = (await session.execute(
+            select(UserInfo.start_time, UserInfo.end_time, UserInfo.leads)
+            # Записи без start_time создают лиды из CRM и отчёты — времени работы у них нет
+            .where(UserInfo.user_id == user_id, UserInfo.end_time.is_not(None), UserInfo.start_time.is_not(None))
+        )).all()
+        total_duration = timedelta()
+        total_leads = 0
+        for start, end, leads in records:
+            total_duration += (end - start)
+            total_leads += leads
+
+        total_str = format_duration(total_duration)
+        daily_msg = f"Ты сегодня проработал {daily_str}, закрыл {user.leads} лида(ов)."
+        total_msg = f"За всё время ты проработал {total_str} и закрыл {total_leads} лида(ов)."
+        return daily_msg, total_msg
+
+
+async def update_group_id(user_id, chat_id):
+    """
+    Обновляет group_id в таблице names для соответствующего real_user_id.
+    """
+    try:
+        async with AsyncSession() as session:
+            result = await session.execute(
+                update(names_table)
+                .where(names_table.c.real_user_id == user_id)
+                .values(group_id=chat_id)
+            )
+            await session.commit()
+        if result.rowcount:
+            logging.info(f"Updated group_id for user_id {user_id} to chat_id {chat_id}.")
+        else:
+            logging.info(f"User with user_id {user_id} not found.")
+    except Exception as e:
+        logging.error(f"Failed to update group_id: {e}")
+
+
+async def get_language_by_chat_id(chat_id: int):
+    """
+    Получить значение language для заданного chat_id.
+    """
+    try:
+        async with AsyncSession() as session:
+            language = (await session.execute(
+                select(names_table.c.language).where(names_table.c.group_id == chat_id)
+            )).scalar()
+        if language is None:
+            logging.info(f"No language found for chat_id {chat_id}")
+        return language
+    except Exception as e:
+        logging.info(f"Error fetching language for chat_id {chat_id}: {e}")
+        return None
+
+
+async def mark_report_received(user_id: int, message_datetime: datetime):
+    """
+    Ставим has_photo=1 у записи за день отчёта (сутки с 18:00 до 18:00), см. get_report_day.
+    """
+    day = get_report_day(message_datetime)
+    logging.info(f"Запущен mark_report_received для user_id={user_id}, day={day}.")
+    async with AsyncSession() as session:
+        await session.execute(build_user_day_upsert(
+            user_id, day,
+            date=datetime.combine(day, datetime.min.time()),
+            has_photo=1
+        ))
+        await session.commit()
+    logging.info(f"Отчёт отмечен: has_photo=1 для user_id={user_id}, day={day}")
@@ -0,0 +1,67 @@
+# engine.py
+# Единственный движок БД для всего проекта (бот, планировщик, экспорт, FastAPI).
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from config import DATABASE_URL
+
+# Переопределение БД через окружение (бенчмарки, отдельная копия базы)
+DATABASE_URL = os.environ.get('DATABASE_URL') or DATABASE_URL
+
+# WAL позволяет ночному экспорту читать, пока хендлеры пишут;
+# busy_timeout вместо мгновенного "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 30000,          # мс
+    'mmap_size': 268435456,         # 256 МБ
+    'cache_size': -65536,           # 64 МБ (отрицательное значение — в КиБ)
+    'temp_store': 'MEMORY',
+}
+
+# Пул соединений: потоки планировщика, экспорта и приёма лидов работают параллельно
+POOL_SIZE = 10
+MAX_OVERFLOW = 20
+POOL_TIMEOUT = 30
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+
+def _is_memory_db(url):
+    return url.database in (None, '', ':memory:')
+
+
+def create_db_engine(url=DATABASE_URL):
+    """Синхронный движок SQLite с прагмами и пулом, пригодным для многопоточной работы."""
+    url = make_url(url)
+    kwargs = {'connect_args': {'check_same_thread': False, 'timeout': POOL_TIMEOUT}}
+    if not _is_memory_db(url):
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_timeout=POOL_TIMEOUT,
+                      pool_pre_ping=True)
+    db_engine = create_engine(url, **kwargs)
+    event.listen(db_engine, 'connect', _apply_sqlite_pragmas)
+    return db_engine
+
+
+def create_async_db_engine(url=DATABASE_URL):
+    """Async-движок (aiosqlite) на ту же БД и с теми же прагмами."""
+    url = make_url(url).set(drivername='sqlite+aiosqlite')
+    db_engine = create_async_engine(url, connect_args={'timeout': POOL_TIMEOUT})
+    event.listen(db_engine.sync_engine, 'connect', _apply_sqlite_pragmas)
+    return db_engine
+
+
+engine = create_db_engine()
+Session = sessionmaker(bind=engine)
+
+async_engine = create_async_db_engine()
+AsyncSession = async_sessionmaker(bind=async_engine, expire_on_commit=False)
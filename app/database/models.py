@@ -1,18 +1,25 @@
 # models.py
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, create_engine
+from sqlalchemy import Column, Integer, String, DateTime, Date, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 from aiogram.fsm.state import State, StatesGroup
 from pydantic import BaseModel
+from typing import Optional
+
+from app.database.engine import engine
 
-engine = create_engine('sqlite:///database.db')
-Session = sessionmaker(bind=engine)
-session = Session()
 Base = declarative_base()
 
+def _default_day(context):
+    """Календарный день записи по умолчанию берём из колонки date."""
+    value = context.get_current_parameters().get('date') or datetime.utcnow()
+    return value.date() if isinstance(value, datetime) else value
+
 class UserInfo(Base):
     __tablename__ = 'user_info'
+    __table_args__ = (
+        Index('ux_user_info_user_day', 'user_id', 'day', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer)
@@ -22,6 +29,7 @@ class UserInfo(Base):
     leads = Column(Integer, default=0)
     has_photo = Column(Integer, default=0)  # Новое поле
     started = Column(Boolean, default=False)
+    day = Column(Date, default=_default_day)  # Рабочий день записи (ключ для поиска вместо date(date))
 
 class MotivationalPhrases(Base):
     __tablename__ = 'motivational_phrases'
@@ -33,9 +41,65 @@ class MotivationalEngPhrases(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     phrase = Column(String, nullable=False)
 
+class ProcessedLeadEvent(Base):
+    __tablename__ = 'processed_lead_events'
+    key = Column(String, primary_key=True)          # Ключ идемпотентности события из CRM
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class DataSheetSnapshot(Base):
+    __tablename__ = 'data_sheet_snapshot'
+    # Последнее состояние скрытого листа Data, отправленное в Google Sheets
+    position = Column(Integer, primary_key=True)    # Индекс строки данных (0 = строка 2 листа)
+    user_name = Column(String, nullable=False)
+    date = Column(String, nullable=False)           # dd/mm/YYYY, как на листе
+    row_json = Column(String, nullable=False)       # Вся строка листа в JSON
+
+class SheetTemplateFingerprint(Base):
+    __tablename__ = 'sheet_template_fingerprints'
+    # Хеш шаблона листа (формулы, валидация, форматирование), отправленного в Google Sheets
+    title = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
 Base.metadata.create_all(engine)
 
 
+def migrate_user_info_day(engine):
+    """
+    Миграция старых БД: добавляет колонку day, заполняет её из date,
+    схлопывает дубли за один день (их создавали гонки) и строит уникальный индекс (user_id, day).
+    """
+    with engine.begin() as conn:
+        columns = [row[1] for row in conn.exec_driver_sql("PRAGMA table_info(user_info)")]
+        if 'day' not in columns:
+            conn.exec_driver_sql("ALTER TABLE user_info ADD COLUMN day DATE")
+        conn.exec_driver_sql("UPDATE user_info SET day = date(date) WHERE day IS NULL")
+
+        # Дубли сливаем в запись с минимальным id: лиды суммируем, остальное берём по максимуму
+        conn.exec_driver_sql("""
+            UPDATE user_info SET
+                leads = (SELECT SUM(COALESCE(u.leads, 0)) FROM user_info u
+                         WHERE u.user_id = user_info.user_id AND u.day = user_info.day),
+                has_photo = (SELECT MAX(COALESCE(u.has_photo, 0)) FROM user_info u
+                             WHERE u.user_id = user_info.user_id AND u.day = user_info.day),
+                start_time = (SELECT MIN(u.start_time) FROM user_info u
+                              WHERE u.user_id = user_info.user_id AND u.day = user_info.day),
+                end_time = (SELECT MAX(u.end_time) FROM user_info u
+                            WHERE u.user_id = user_info.user_id AND u.day = user_info.day),
+                started = (SELECT MAX(COALESCE(u.started, 0)) FROM user_info u
+                           WHERE u.user_id = user_info.user_id AND u.day = user_info.day)
+            WHERE id IN (SELECT MIN(id) FROM user_info GROUP BY user_id, day HAVING COUNT(*) > 1)
+        """)
+        conn.exec_driver_sql(
+            "DELETE FROM user_info WHERE id NOT IN (SELECT MIN(id) FROM user_info GROUP BY user_id, day)"
+        )
+        conn.exec_driver_sql(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_user_info_user_day ON user_info (user_id, day)"
+        )
+
+migrate_user_info_day(engine)
+
+
 # Состояния для добавления/удаления пользователей
 class AddUserState:
     waiting_for_user = "waiting_for_user"           # Ждем user_id
@@ -50,3 +114,4 @@ class DelUserState:
 class LeadData(BaseModel):
     chat_id: str
     lead_count: int
+    idempotency_key: Optional[str] = None  # Повторы CRM с тем же ключом не учитываются
@@ -4,19 +4,20 @@ import logging
 import requests
 import httpx
 from oauth2client.service_account import ServiceAccountCredentials
-from sqlalchemy import create_engine, func, select, update, Table, MetaData, and_
-from sqlalchemy.orm import sessionmaker, Session
-from app.database.models import MotivationalPhrases, MotivationalEngPhrases, UserInfo
+from sqlalchemy import func, select, update, case, Table, MetaData, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from app.database.models import MotivationalPhrases, MotivationalEngPhrases, UserInfo, ProcessedLeadEvent
 from datetime import datetime, timedelta
-from config import JSON_FILE, DATABASE_URL, GOOGLE_SHEET, API_TOKEN
+from app.database.engine import engine, Session
+from app.sheets_limiter import sheets_limiter
+from config import JSON_FILE, GOOGLE_SHEET, API_TOKEN
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 
-# Создание движка и сессии
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
+# Общий движок и фабрика сессий — из app.database.engine.
+# Сессия открывается на каждую единицу работы (with Session() as session), глобальной сессии нет:
+# функции вызываются одновременно из event loop, потоков планировщика и пулов экспорта.
 
 # Определение таблицы
 metadata = MetaData()
@@ -73,10 +74,11 @@ def get_random_phrase():
     Returns:
         str: Мотивационная фраза или сообщение о том, что фразы отсутствуют.
     """
-    phrase_record = session.query(MotivationalPhrases).order_by(func.random()).first()
-    if phrase_record is None:
+    with Session() as session:
+        phrase = session.query(MotivationalPhrases.phrase).order_by(func.random()).limit(1).scalar()
+    if phrase is None:
         return "Нет мотивационных фраз в базе данных."
-    return phrase_record.phrase
+    return phrase
 
 
 def get_eng_random_phrase():
@@ -86,10 +88,11 @@ def get_eng_random_phrase():
     Returns:
         str: Мотивационная фраза или сообщение о том, что фразы отсутствуют.
     """
-    phrase_record = session.query(MotivationalEngPhrases).order_by(func.random()).first()
-    if phrase_record is None:
+    with Session() as session:
+        phrase = session.query(MotivationalEngPhrases.phrase).order_by(func.random()).limit(1).scalar()
+    if phrase is None:
         return "Нет мотивационных фраз в базе данных."
-    return phrase_record.phrase
+    return phrase
 
 
 def check_start_work(user_id):
@@ -102,45 +105,66 @@ def check_start_work(user_id):
     Returns:
         UserInfo: Информация о пользователе или None, если работа не начата.
     """
-    return session.query(UserInfo).filter_by(user_id=user_id, end_time=None).first()
+    with Session() as session:
+        return session.query(UserInfo).filter_by(user_id=user_id, end_time=None).first()
+
+
+def upsert_user_day(session, user_id, day, date=None, start_time=None, started=False, leads=0, has_photo=None):
+    """
+    Создать или обновить запись user_info за день одним запросом
+    INSERT ... ON CONFLICT(user_id, day) DO UPDATE. Коммит — на вызывающей стороне.
+
+    Args:
+        session (Session): Сессия БД.
+        user_id (int): ID пользователя.
+        day (date): Рабочий день записи.
+        date (datetime): Значение колонки date для новой записи (по умолчанию — сейчас).
+        start_time (datetime): Время старта; ставится, только если его ещё нет.
+        started (bool): Флаг started (меняется вместе со start_time).
+        leads (int): Сколько лидов прибавить.
+        has_photo (int): Если задано, выставляется отметка об отчёте.
+    """
+    session.execute(build_user_day_upsert(
+        user_id, day, date=date, start_time=start_time, started=started, leads=leads, has_photo=has_photo
+    ))
+
+
+def build_user_day_upsert(user_id, day, date=None, start_time=None, started=False, leads=0, has_photo=None):
+    """Собрать INSERT ... ON CONFLICT для upsert_user_day (общий для sync и async слоёв)."""
+    table = UserInfo.__table__
+    stmt = sqlite_insert(table).values(
+        user_id=user_id,
+        day=day,
+        date=date or datetime.now(),
+        start_time=start_time,
+        started=started,
+        leads=leads,
+        has_photo=has_photo or 0
+    )
+    excluded = stmt.excluded
+    set_ = {}
+    if leads:
+        set_['leads'] = func.coalesce(table.c.leads, 0) + excluded.leads
+    if start_time is not None:
+        # SQLite вычисляет все выражения SET по исходной строке, так что порядок не важен
+        set_['started'] = case((table.c.start_time.is_(None), excluded.started), else_=table.c.started)
+        set_['start_time'] = func.coalesce(table.c.start_time, excluded.start_time)
+    if has_photo is not None:
+        set_['has_photo'] = excluded.has_photo
+
+    if set_:
+        return stmt.on_conflict_do_update(index_elements=[table.c.user_id, table.c.day], set_=set_)
+    return stmt.on_conflict_do_nothing(index_elements=[table.c.user_id, table.c.day])
 
 
 def add_user_info(user_id, start_time, started=False):
     try:
         with Session() as session:
             today = start_time.date()
-            # Ищем запись за сегодня
-            existing_info = session.query(UserInfo).filter(
-                UserInfo.user_id == user_id,
-                func.date(UserInfo.date) == today
-            ).first()
-            
-            if existing_info:
-                # Запись за сегодня уже есть
-                if existing_info.start_time is None:
-                    # Дополняем start_time, если его не было
-                    existing_info.start_time = start_time
-                    existing_info.started = started
-                    session.commit()
-                    logging.info(
-                        f"Updated start_time for existing UserInfo on {today} for user_id: {user_id}"
-                    )
-                else:
-                    # start_time уже стоит или рабочий день был начат ранее
-                    logging.info(
-                        f"UserInfo for user_id={user_id} on {today} already has start_time={existing_info.start_time}"
-                    )
-            else:
-                # Нет записи — создаём новую
-                user_info = UserInfo(
-                    user_id=user_id,
-                    date=start_time,
-                    start_time=start_time,
-                    started=started
-                )
-                session.add(user_info)
-                session.commit()
-                logging.info(f"Added new UserInfo record for user_id: {user_id}, date={today}")
+            # Запись за сегодня создаётся или дополняется start_time, если его не было
+            upsert_user_day(session, user_id, today, date=start_time, start_time=start_time, started=started)
+            session.commit()
+            logging.info(f"Upserted UserInfo start_time for user_id: {user_id}, date={today}")
     except Exception as e:
         logging.error(f"Failed to add or update UserInfo: {e}")
 
@@ -203,31 +227,174 @@ def update_leads_from_crm(chat_id, leads):
         real_user_id = name_entry.real_user_id
         logging.info(f"Найден user_id={real_user_id} для chat_id={chat_id}")
 
+        # Прибавляем лиды к записи за сегодня (или создаём её, считая, что день начался)
         today = datetime.now().date()
-        user_info = session.query(UserInfo).filter(
-            and_(UserInfo.user_id == real_user_id, func.date(UserInfo.date) == today)
-        ).first()
+        upsert_user_day(session, real_user_id, today, started=True, leads=leads)
+        session.commit()
+        logging.info(f"Обновлены лиды для user_id={real_user_id}, добавлено {leads}.")
 
-        if user_info:
-            # Уже есть запись за сегодня — добавляем лиды
-            user_info.leads += leads
-            session.commit()
-            logging.info(f"Обновлены лиды для user_id={real_user_id}, добавлено {leads}.")
-        else:
-            # Нет записи, создаём новую
-            new_user_info = UserInfo(
-                user_id=real_user_id,
-                date=datetime.now(),
-                leads=leads,
-                started=True  # если хотим считать, что день начался
+    # Запрос обновления Google Sheets (склеивается с соседними)
+    from app.sheets_sync import sheets_sync
+    sheets_sync.mark_dirty()
+
+
+def get_user_id_by_chat_id(chat_id):
+    """
+    Найти real_user_id по group_id (chat_id) в таблице names.
+
+    Returns:
+        int: real_user_id или None, если пользователь не найден.
+    """
+    with Session() as session:
+        row = session.execute(
+            select(names_table.c.real_user_id).where(names_table.c.group_id == chat_id)
+        ).fetchone()
+        return row[0] if row else None
+
+
+def flush_lead_increments(increments, event_keys=()):
+    """
+    Записать накопленные приращения лидов одной транзакцией.
+
+    Для каждого ключа выполняется атомарный upsert с leads = leads + ?,
+    без чтения записи; если записи за день ещё нет, она создаётся.
+    Ключи идемпотентности событий, вошедших в приращения, фиксируются в той же
+    транзакции: либо записаны и лиды, и ключи, либо ни то ни другое.
+
+    Args:
+        increments (dict): {(user_id, day): leads}.
+        event_keys (Iterable[str]): Ключи идемпотентности этих событий.
+    """
+    logging.info(f'flush_lead_increments: {len(increments)} ключей')
+    with Session() as session:
+        for (user_id, day), leads in increments.items():
+            upsert_user_day(
+                session, user_id, day,
+                date=datetime.combine(day, datetime.now().time()),
+                started=True,
+                leads=leads
             )
-            session.add(new_user_info)
-            session.commit()
-            logging.info(f"Создана новая запись user_info для user_id={real_user_id}, leads={leads}.")
+        record_lead_events(session, event_keys)
+        session.commit()
+
+    # Запрос обновления Google Sheets (склеивается с соседними)
+    from app.sheets_sync import sheets_sync
+    sheets_sync.mark_dirty()
 
-    # Запуск обновления Google Sheets
-    import export_google
-    asyncio.run(export_google.update_user_data())
+
+def is_lead_event_processed(key, ttl):
+    """
+    Проверить, обработано ли событие CRM с этим ключом идемпотентности.
+
+    Args:
+        key (str): Ключ идемпотентности.
+        ttl (timedelta): Сколько помнить обработанные ключи.
+
+    Returns:
+        bool: True, если ключ записан не раньше ttl назад.
+    """
+    with Session() as session:
+        created_at = session.query(ProcessedLeadEvent.created_at).filter(
+            ProcessedLeadEvent.key == key
+        ).scalar()
+    return created_at is not None and created_at >= datetime.utcnow() - ttl
+
+
+def record_lead_events(session, keys):
+    """
+    Записать ключи обработанных событий CRM в текущей транзакции (без commit).
+
+    Одним INSERT ... ON CONFLICT: новый ключ вставляется, существующий получает
+    новое время, чтобы отсчёт ttl шёл от последней обработки.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return
+    now = datetime.utcnow()
+    stmt = sqlite_insert(ProcessedLeadEvent).values([{'key': key, 'created_at': now} for key in keys])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[ProcessedLeadEvent.key],
+        set_={'created_at': stmt.excluded.created_at}
+    ))
+
+
+def prune_lead_events(ttl):
+    """Удалить ключи событий старше ttl."""
+    with Session() as session:
+        deleted = session.query(ProcessedLeadEvent).filter(
+            ProcessedLeadEvent.created_at < datetime.utcnow() - ttl
+        ).delete()
+        session.commit()
+    logging.info(f"prune_lead_events: удалено {deleted} ключей.")
+    return deleted
+
+
+async def update_leads_from_crm_batch_async(items):
+    """
+    Асинхронная оболочка для update_leads_from_crm_batch.
+    """
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, update_leads_from_crm_batch, items)
+    logging.info('update_leads_from_crm_batch_async завершён.')
+    return results
+
+
+def update_leads_from_crm_batch(items, event_keys=()):
+    """
+    Пакетное обновление лидов из CRM в одной транзакции.
+
+    Args:
+        items (list): Список пар (chat_id, lead_count) в порядке поступления.
+        event_keys (Iterable[str]): Ключи идемпотентности событий пакета;
+            фиксируются в той же транзакции, что и лиды.
+
+    Returns:
+        list: Результат по каждому элементу в том же порядке
+              (chat_id, lead_count, status, user_id).
+    """
+    logging.info(f'Функция update_leads_from_crm_batch: {len(items)} событий')
+    if not items:
+        return []
+
+    # Суммируем прирост по каждому chat_id, чтобы трогать запись user_info один раз
+    increments = {}
+    for chat_id, leads in items:
+        increments[chat_id] = increments.get(chat_id, 0) + leads
+
+    results = []
+    with Session() as session:
+        # Один запрос к names на все различные chat_id
+        rows = session.query(names_table.c.group_id, names_table.c.real_user_id).filter(
+            names_table.c.group_id.in_(list(increments))
+        ).all()
+        users_by_chat = {str(group_id): real_user_id for group_id, real_user_id in rows}
+
+        today = datetime.now().date()
+        for chat_id, leads in increments.items():
+            real_user_id = users_by_chat.get(str(chat_id))
+            if real_user_id is None:
+                logging.info(f"Не найден пользователь с chat_id: {chat_id}")
+                continue
+
+            upsert_user_day(session, real_user_id, today, started=True, leads=leads)
+            logging.info(f"Добавлено {leads} лидов для user_id={real_user_id} (chat_id={chat_id}).")
+        record_lead_events(session, event_keys)
+        session.commit()
+
+    applied = False
+    for chat_id, leads in items:
+        real_user_id = users_by_chat.get(str(chat_id))
+        if real_user_id is None:
+            results.append({"chat_id": chat_id, "lead_count": leads, "status": "not_found", "user_id": None})
+        else:
+            applied = True
+            results.append({"chat_id": chat_id, "lead_count": leads, "status": "success", "user_id": real_user_id})
+
+    # Одно обновление Google Sheets на весь пакет
+    if applied:
+        from app.sheets_sync import sheets_sync
+        sheets_sync.mark_dirty()
+    return results
 
 
 def end_work(user_id, end_time):
@@ -238,7 +405,8 @@ def end_work(user_id, end_time):
             and_(
                 UserInfo.user_id == user_id,
                 UserInfo.end_time.is_(None),
-                func.date(UserInfo.start_time) == today
+                UserInfo.start_time.is_not(None),
+                UserInfo.day == today
             )
         ).first()
         if user:
@@ -254,7 +422,8 @@ def end_work(user_id, end_time):
             total_duration = timedelta()
             total_leads = 0
             for rec in all_records:
-                if rec.end_time:
+                # Записи без start_time создают лиды из CRM и отчёты — времени работы у них нет
+                if rec.end_time and rec.start_time:
                     total_duration += (rec.end_time - rec.start_time)
                     total_leads += rec.leads
 
@@ -402,13 +571,17 @@ def authorize_google_sheets():
 
 def update_sheet(real_name):
     client = authorize_google_sheets()
+    sheets_limiter.acquire('read')
     spreadsheet = client.open(GOOGLE_SHEET)
 
     try:
+        sheets_limiter.acquire('read')
         worksheet = spreadsheet.worksheet(real_name)
         print(f"Worksheet '{real_name}' exists.")
     except gspread.exceptions.WorksheetNotFound:
+        sheets_limiter.acquire('write')
         worksheet = spreadsheet.add_worksheet(title=real_name, rows="100", cols="20")
+        sheets_limiter.acquire('write')
         worksheet.update('A1', [[real_name]])
         print(f"Worksheet '{real_name}' created.")
 
@@ -418,26 +591,25 @@ def send_daily_leads_to_group():
     Calculate today's leads for each user and send the total to their respective group chat.
     """
     try:
-        # Fetch all users from the names table
-        users = session.query(names_table).all()
-        
         today = datetime.now().date()
 
+        # Read everything in one short session, then talk to Telegram without holding a connection
+        with Session() as session:
+            users = session.query(names_table).all()
+            leads_by_user = dict(
+                session.query(UserInfo.user_id, func.sum(UserInfo.leads))
+                .filter(UserInfo.day == today)
+                .group_by(UserInfo.user_id)
+                .all()
+            )
+
         for user in users:
             # Check if the user has a valid group_id
             if not user.group_id:
                 print(f"No group ID found for user {user.real_name} (ID: {user.real_user_id}). Skipping.")
                 continue
 
-            # Calculate today's leads for the user
-            leads_today = session.query(func.sum(UserInfo.leads)).filter(
-                and_(
-                    UserInfo.user_id == user.real_user_id,
-                    func.date(UserInfo.date) == today
-                )
-            ).scalar()
-
-            leads_today = leads_today or 0  # Set to 0 if no leads found
+            leads_today = leads_by_user.get(user.real_user_id) or 0  # Set to 0 if no leads found
 
             # Prepare the message
             message = f"Сегодня {today.strftime('%Y-%m-%d')} у пользователя {user.real_name} закрыто {leads_today} лида(ов)."
@@ -518,16 +690,9 @@ def get_head_username_from_telegram(head_id: int):
         return None
     
 
-def mark_report_received(user_id: int, message_datetime: datetime):
+def get_report_day(message_datetime: datetime):
     """
-    Ставим has_photo=1 у записи, соответствующей «дню», вычисленному 
-    по смещённым суткам (с 18:00 до 18:00). 
-    
-    Логика:
-    - Берём фактическую дату message_datetime (например, 2024-12-25 19:05).
-    - Если время >= 18:00, то отчёт считаем за «следующий календарный день».
-    - Иначе — за «тот же календарный день».
-    - Находим (или создаём) запись в user_info за этот день и выставляем has_photo=1.
+    День, за который засчитывается отчёт: сутки смещены и идут с 18:00 до 18:00.
     """
     # Приведём время к нужному часовому поясу, если нужно (пример не учитывает TZ).
     local_dt = message_datetime  # Если уже local, то ок
@@ -540,32 +705,32 @@ def mark_report_received(user_id: int, message_datetime: datetime):
     # Если >= 18, то отчёт идёт за day+1
     if hour >= 18:
         day = day + timedelta(days=1)
+    return day
+
+
+def mark_report_received(user_id: int, message_datetime: datetime):
+    """
+    Ставим has_photo=1 у записи, соответствующей «дню», вычисленному 
+    по смещённым суткам (с 18:00 до 18:00). 
+    
+    Логика:
+    - Берём фактическую дату message_datetime (например, 2024-12-25 19:05).
+    - Если время >= 18:00, то отчёт считаем за «следующий календарный день».
+    - Иначе — за «тот же календарный день».
+    - Находим (или создаём) запись в user_info за этот день и выставляем has_photo=1.
+    """
+    day = get_report_day(message_datetime)
     logging.info(f"Запущен mark_report_received для user_id={user_id}, day={day}.")
 
     with Session() as local_session:
-        # Ищем запись за «этот» day
-        user_info = local_session.query(UserInfo).filter(
-            and_(
-                UserInfo.user_id == user_id,
-                func.date(UserInfo.date) == day
-            )
-        ).first()
-
-        if user_info:
-            # Запись есть — обновляем has_photo=1
-            user_info.has_photo = 1
-            local_session.commit()
-            logging.info(f"Отчёт обновлён: has_photo=1 для user_id={user_id}, day={day}")
-        else:
-            # Создаём новую запись (без start_time, если ещё нет)
-            new_record = UserInfo(
-                user_id=user_id,
-                date=day,       # Дата — уже со смещением
-                has_photo=1
-            )
-            local_session.add(new_record)
-            local_session.commit()
-            logging.info(f"Создана новая запись user_info (has_photo=1) для user_id={user_id}, day={day}")
+        # Ставим has_photo=1 у записи за «этот» day (или создаём её без start_time)
+        upsert_user_day(
+            local_session, user_id, day,
+            date=datetime.combine(day, datetime.min.time()),  # Дата — уже со смещением
+            has_photo=1
+        )
+        local_session.commit()
+        logging.info(f"Отчёт отмечен: has_photo=1 для user_id={user_id}, day={day}")
 
 
 
@@ -580,11 +745,8 @@ async def check_daily_reports(key_in_messages_table: str):
     from sqlalchemy.orm import aliased
     ui = aliased(UserInfo)
 
-    with Session() as session:  # Но SessionLocal() не async, поэтому придётся оставить sync style
-        # Здесь, чтобы не ломать сильно код, оставим sync контекст
-        session_sync = Session()
-
-        query = (session_sync.query(
+    with Session() as session:
+        query = (session.query(
                     names_table.c.real_user_id,
                     names_table.c.group_id,
                     names_table.c.language,
@@ -593,13 +755,12 @@ async def check_daily_reports(key_in_messages_table: str):
                 )
                 .outerjoin(ui, and_(
                     ui.user_id == names_table.c.real_user_id,
-                    func.date(ui.date) == today
+                    ui.day == today
                 ))
                 .filter((ui.id == None) | (ui.has_photo == 0))
         )
 
         users = query.all()
-        session_sync.close()
 
     for (u_id, group_id, lang, username_in_db, has_photo) in users:
         if not group_id:
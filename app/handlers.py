@@ -1,6 +1,5 @@
 # handlers.py
 import logging
-import asyncio
 from datetime import datetime
 
 from aiogram import Router, F
@@ -11,12 +10,15 @@ from aiogram.fsm.context import FSMContext
 from config import ALLOWED_IDS
 from app.database.models import UserInfo, AddUserState, DelUserState
 from app.database.requests import (
+    del_manager_from_db_by_name, show_state_list, get_amocrm_id_by_name
+)
+from app.database.async_requests import (
     add_user_info, get_random_phrase, get_eng_random_phrase,
     end_work, update_group_id,
-    del_manager_from_db_by_name, show_state_list,
-    get_language_by_chat_id, get_amocrm_id_by_name, mark_report_received
+    get_language_by_chat_id, mark_report_received
 )
-import export_google
+from app.sheets_sync import sheets_sync
+from export_google import ALL_STAGES, FORMATTING_STAGES
 import app.keyboards as kb
 
 router = Router()
@@ -89,25 +91,15 @@ async def show_staff(message: Message):
 @router.message(F.text == "Обновить форматирование таблиц", F.from_user.id.in_(ALLOWED_IDS))
 async def update_format_google(message: Message):
     await message.answer("Обновление форматирования запущено...")
-    loop = asyncio.get_running_loop()
-
-    def run_main_sync():
-        asyncio.run(export_google.main())
-
-    await loop.run_in_executor(None, run_main_sync)
+    # Только форматирование, без выгрузки БД; принудительно — даже если хеши совпадают
+    await sheets_sync.mark_dirty(FORMATTING_STAGES, force=True)
     await message.answer("Обновлено!")
 
 
 @router.message(F.text == "Обновить данные таблиц", F.from_user.id.in_(ALLOWED_IDS))
 async def update_date_google(message: Message):
     await message.answer("Обновление данных запущено...")
-    loop = asyncio.get_running_loop()
-
-    def run_update_user_data_sync():
-        asyncio.run(export_google.update_user_data())
-
-    await loop.run_in_executor(None, run_update_user_data_sync)
-    await export_google.update_user_data()
+    await sheets_sync.mark_dirty()
     await message.answer("Обновлено!")
 
 
@@ -203,12 +195,7 @@ async def process_user_language(message: Message, state: FSMContext):
         await state.clear()
 
         # Обновляем Google Sheet
-        loop = asyncio.get_running_loop()
-
-        def run_main_after_adding_user():
-            asyncio.run(export_google.main())
-
-        await loop.run_in_executor(None, run_main_after_adding_user)
+        sheets_sync.mark_dirty(ALL_STAGES)
     else:
         # category=1 или 2 => нужно выбрать РОП из inline-кнопок
         from app.database.requests import get_all_rops
@@ -248,12 +235,7 @@ async def process_rop_selected(callback: CallbackQuery, state: FSMContext):
     await state.clear()
 
     # Обновляем Google Sheet
-    loop = asyncio.get_running_loop()
-
-    def run_main_after_adding_user():
-        asyncio.run(export_google.main())
-
-    await loop.run_in_executor(None, run_main_after_adding_user)
+    sheets_sync.mark_dirty(ALL_STAGES)
 
 
 # ====================== Старт/Финиш ======================
@@ -265,25 +247,22 @@ async def start_work(message: Message):
     logging.info(f"Пользователь {user_id} активировал обработчик start_work.")  # Логируем
     try:
         start_time = datetime.now()
-        add_user_info(user_id, start_time, started=True)
-        update_group_id(user_id, group_id)
+        await add_user_info(user_id, start_time, started=True)
+        await update_group_id(user_id, group_id)
 
-        language = get_language_by_chat_id(group_id) or 'ru'
+        language = await get_language_by_chat_id(group_id) or 'ru'
         if language == 'en':
-            phrase = get_eng_random_phrase()
+            phrase = await get_eng_random_phrase()
             text = "Have a productive day!"
         else:
-            phrase = get_random_phrase()
+            phrase = await get_random_phrase()
             text = "Продуктивного дня!"
 
         logging.info(f"User {user_id} start_work -> group_id={group_id}, lang={language}")
         await message.answer(phrase)
         await message.answer(text)
 
-        try:
-            await export_google.update_user_data()
-        except TypeError as e:
-            logging.error(f"start_work -> update_user_data error: {e}")
+        sheets_sync.mark_dirty()
     except Exception as e:
         logging.error(f"start_work error: {e}")
 
@@ -295,10 +274,10 @@ async def finish_work(message: Message):
     logging.info(f"Пользователь {user_id} активировал обработчик finish_work.")  # Логируем
     try:
         end_time = datetime.now()
-        daily_message, total_message = end_work(user_id, end_time)
-        update_group_id(user_id, group_id)
+        daily_message, total_message = await end_work(user_id, end_time)
+        await update_group_id(user_id, group_id)
 
-        language = get_language_by_chat_id(message.chat.id) or 'ru'
+        language = await get_language_by_chat_id(message.chat.id) or 'ru'
         if language == 'en':
             txt = "Thank you for your work and have a pleasant rest!"
         else:
@@ -309,10 +288,7 @@ async def finish_work(message: Message):
         # await message.answer(daily_message)
         # await message.answer(total_message)
 
-        try:
-            await export_google.update_user_data()
-        except TypeError as e:
-            logging.error(f"finish_work -> update_user_data error: {e}")
+        sheets_sync.mark_dirty()
     except Exception as e:
         logging.error(f"finish_work error: {e}")
 
@@ -352,7 +328,7 @@ async def forward_message(message: Message):
             if "#отчет" in text_lower or "#report" in text_lower:
                 msg_time = datetime.now()
                 logging.info(f"{msg_time} Message with report received, user_id={user_id}.")
-                mark_report_received(user_id, msg_time)
+                await mark_report_received(user_id, msg_time)
 
     except Exception as e:
         logging.error(f"Failed to forward message from user {user_id}: {e}")
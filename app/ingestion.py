@@ -0,0 +1,123 @@
+# ingestion.py
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Размер очереди входящих событий CRM, число обработчиков и подсказка клиенту при переполнении
+LEAD_QUEUE_MAXSIZE = 1000
+LEAD_INGEST_WORKERS = 4
+LEAD_RETRY_AFTER_SECONDS = 5
+
+
+class LeadIngestionQueue:
+    """
+    Ограниченная очередь приёма лидов со своим пулом потоков.
+
+    Приём лидов не делит пул по умолчанию с выгрузкой в Google Sheets, поэтому
+    долгий экспорт не задерживает вебхуки CRM. Если очередь заполнена, submit()
+    бросает asyncio.QueueFull, и эндпоинт отвечает 429 с Retry-After.
+    """
+
+    def __init__(self, maxsize=LEAD_QUEUE_MAXSIZE, workers=LEAD_INGEST_WORKERS,
+                 retry_after=LEAD_RETRY_AFTER_SECONDS):
+        self.maxsize = maxsize
+        self.workers = workers
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='lead-ingest')
+        self._queue = None
+        self._tasks = []
+
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._processing_total = 0.0
+        self._processing_max = 0.0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, job):
+        """
+        Поставить задачу в очередь.
+
+        Args:
+            job: Функция без аргументов, возвращающая корутину.
+
+        Returns:
+            asyncio.Future: Результат задачи.
+
+        Raises:
+            asyncio.QueueFull: Очередь заполнена.
+        """
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((time.monotonic(), job, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            logging.warning(f"Очередь приёма лидов заполнена ({self.maxsize}), событие отклонено.")
+            raise
+        return future
+
+    async def run_in_executor(self, func, *args):
+        """Выполнить синхронную функцию в пуле приёма лидов."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _worker(self):
+        while True:
+            enqueued_at, job, future = await self._queue.get()
+            started_at = time.monotonic()
+            wait = started_at - enqueued_at
+            try:
+                result = await job()
+            except Exception as e:
+                self.failed += 1
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                processing = time.monotonic() - started_at
+                self.processed += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                self._processing_total += processing
+                self._processing_max = max(self._processing_max, processing)
+                self._queue.task_done()
+
+    def stats(self):
+        done = self.processed or 1
+        return {
+            "depth": self._queue.qsize() if self._queue else 0,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self._wait_total / done * 1000, 2),
+            "max_wait_ms": round(self._wait_max * 1000, 2),
+            "avg_processing_ms": round(self._processing_total / done * 1000, 2),
+            "max_processing_ms": round(self._processing_max * 1000, 2),
+        }
+
+    async def stop(self):
+        """Дождаться обработки очереди и остановить обработчики."""
+        if self._queue is not None:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+lead_ingestion = LeadIngestionQueue()
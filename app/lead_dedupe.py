@@ -0,0 +1,93 @@
+# lead_dedupe.py
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from app.database.requests import is_lead_event_processed, prune_lead_events
+from app.ingestion import lead_ingestion
+
+# Сколько ключей держать в памяти и как долго считать событие повтором
+LEAD_DEDUPE_MAX_SIZE = 10000
+LEAD_DEDUPE_TTL_SECONDS = 2 * 24 * 3600
+# Раз в столько новых ключей чистим старые записи в БД
+LEAD_DEDUPE_PRUNE_EVERY = 1000
+
+
+class LeadDedupeCache:
+    """
+    Отсеивает повторы событий CRM по ключу идемпотентности.
+
+    Недавние ключи хранятся в памяти (LRU с TTL), поэтому повтор отбрасывается
+    без обращения к БД. Источник истины — таблица processed_lead_events,
+    так что ключи переживают перезапуск.
+
+    claim() только резервирует ключ в памяти; в БД он записывается в той же
+    транзакции, что и лиды события (flush_lead_increments, update_leads_from_crm_batch),
+    после чего вызывается confirm(). Если процесс упадёт раньше, в БД не останется
+    ни лидов, ни ключа, и повтор CRM будет принят.
+    """
+
+    def __init__(self, max_size=LEAD_DEDUPE_MAX_SIZE, ttl_seconds=LEAD_DEDUPE_TTL_SECONDS):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._seen = OrderedDict()  # {key: time.time() записи в БД}
+        self._reserved = set()      # ключи событий, лиды которых ещё не записаны
+        self._claims = 0
+
+    def _remember(self, key):
+        self._seen[key] = time.time()
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.max_size:
+            self._seen.popitem(last=False)
+
+    def _seen_recently(self, key):
+        seen_at = self._seen.get(key)
+        if seen_at is None:
+            return False
+        if time.time() - seen_at >= self.ttl_seconds:
+            del self._seen[key]
+            return False
+        self._seen.move_to_end(key)
+        return True
+
+    async def claim(self, key):
+        """
+        Зарезервировать ключ события.
+
+        Returns:
+            bool: True, если событие новое; False, если это повтор
+                  (уже записанный или ещё ожидающий записи).
+        """
+        if key in self._reserved or self._seen_recently(key):
+            return False
+        # Резерв ставится до await, чтобы одновременный повтор не прошёл проверку
+        self._reserved.add(key)
+
+        ttl = timedelta(seconds=self.ttl_seconds)
+        try:
+            processed = await lead_ingestion.run_in_executor(is_lead_event_processed, key, ttl)
+        except Exception:
+            self._reserved.discard(key)
+            raise
+        if processed:
+            self._reserved.discard(key)
+            self._remember(key)
+            return False
+        return True
+
+    def confirm(self, keys):
+        """Ключи записаны в БД вместе с лидами: перенести их из резерва в кэш."""
+        ttl = timedelta(seconds=self.ttl_seconds)
+        for key in keys:
+            self._reserved.discard(key)
+            self._remember(key)
+            self._claims += 1
+            if self._claims % LEAD_DEDUPE_PRUNE_EVERY == 0:
+                lead_ingestion.executor.submit(prune_lead_events, ttl)
+
+    def release(self, key):
+        """Снять резерв после неудачной обработки, чтобы повтор CRM был принят."""
+        self._reserved.discard(key)
+
+
+lead_dedupe = LeadDedupeCache()
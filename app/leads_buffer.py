@@ -0,0 +1,116 @@
+# leads_buffer.py
+import asyncio
+import logging
+from datetime import datetime
+
+from app.database.requests import get_user_id_by_chat_id, flush_lead_increments
+from app.ingestion import lead_ingestion
+from app.lead_dedupe import lead_dedupe
+
+# Как часто сбрасывать накопленные лиды в БД и после скольких событий сбрасывать досрочно
+LEADS_FLUSH_INTERVAL_MS = 1000
+LEADS_FLUSH_MAX_EVENTS = 200
+
+
+class LeadAccumulator:
+    """
+    Буфер приращений лидов в памяти с отложенной записью в БД.
+
+    Приращения копятся по ключу (user_id, day) и сбрасываются одной транзакцией
+    каждые flush_interval_ms миллисекунд или после max_events событий. Ключи
+    идемпотентности событий копятся вместе с ними и записываются в той же транзакции.
+    """
+
+    def __init__(self, flush_interval_ms=LEADS_FLUSH_INTERVAL_MS, max_events=LEADS_FLUSH_MAX_EVENTS):
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_events = max_events
+        self._pending = {}          # {(user_id, day): leads}
+        self._pending_keys = []     # ключи идемпотентности событий из _pending
+        self._pending_events = 0
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def pending_count(self):
+        """Количество событий, ещё не записанных в БД."""
+        return self._pending_events
+
+    def add(self, user_id, leads, day=None, event_key=None):
+        day = day or datetime.now().date()
+        key = (user_id, day)
+        self._pending[key] = self._pending.get(key, 0) + leads
+        if event_key:
+            self._pending_keys.append(event_key)
+        self._pending_events += 1
+        if self._pending_events >= self.max_events:
+            self._wakeup.set()
+
+    async def add_from_chat(self, chat_id, leads, event_key=None):
+        """
+        Найти пользователя по chat_id и добавить лиды в буфер.
+        event_key — ключ идемпотентности события, зарезервированный lead_dedupe.claim().
+
+        Returns:
+            int: real_user_id или None, если пользователь не найден.
+        """
+        user_id = await lead_ingestion.run_in_executor(get_user_id_by_chat_id, chat_id)
+        if user_id is None:
+            logging.info(f"Не найден пользователь с chat_id: {chat_id}")
+            return None
+        self.add(user_id, leads, event_key=event_key)
+        return user_id
+
+    async def flush(self):
+        """
+        Записать всё накопленное в БД. При ошибке приращения возвращаются в буфер.
+
+        Returns:
+            int: Количество записанных событий.
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+            event_keys, self._pending_keys = self._pending_keys, []
+            events, self._pending_events = self._pending_events, 0
+
+            try:
+                await lead_ingestion.run_in_executor(flush_lead_increments, pending, event_keys)
+            except Exception as e:
+                logging.error(f"Не удалось записать лиды ({events} событий), повтор при следующем сбросе: {e}")
+                for key, leads in pending.items():
+                    self._pending[key] = self._pending.get(key, 0) + leads
+                self._pending_keys[:0] = event_keys
+                self._pending_events += events
+                return 0
+            lead_dedupe.confirm(event_keys)
+            logging.info(f"Лиды записаны в БД: {events} событий, {len(pending)} ключей.")
+            return events
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновый сброс и записать остаток."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+lead_accumulator = LeadAccumulator()
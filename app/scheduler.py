@@ -3,16 +3,16 @@ import logging
 import asyncio
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime, timedelta, timezone
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from app.database.engine import Session
 from app.database.models import UserInfo
-from app.database.requests import engine, check_daily_reports, send_report_1_message
-import export_google
+from app.database.requests import check_daily_reports, send_report_1_message
+from app.sheets_sync import sheets_sync
+from export_google import ALL_STAGES
+from export_snapshot import export_snapshot
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 bali_tz = timezone(timedelta(hours=8))
-Session = sessionmaker(bind=engine)
 
 def end_work_automatically():
     """
@@ -47,14 +47,15 @@ async def send_message_to_user(user_id, message):
         print(f"Ошибка при отправке сообщения пользователю {user_id}: {e}")
 
 def update_google_sheet_wrapper():
-    asyncio.run(update_google_sheet())
+    sheets_sync.mark_dirty(ALL_STAGES)
+    print(f"Запущено обновление Google Sheet")
 
-async def update_google_sheet():
+def export_snapshot_wrapper():
+    """Ночной локальный снимок данных (Parquet/CSV) для отчётов — без Google Sheets API."""
     try:
-        await export_google.main()
-        print(f"Запущено обновление Google Sheet")
+        export_snapshot()
     except Exception as e:
-        print(f"Ошибка при новлении Google Sheet: {e}")
+        logging.error(f"Ошибка при сохранении снимка данных: {e}")
 
 def check_scheduler_status():
     current_time = datetime.now(bali_tz)
@@ -83,6 +84,7 @@ def send_report_1_message_wrapper(user_id: int, user_language: str):
 scheduler = BackgroundScheduler(timezone=bali_tz)
 scheduler.add_job(end_work_automatically, 'cron', hour=23, minute=59)
 scheduler.add_job(update_google_sheet_wrapper, 'cron', hour=1, minute=0)
+scheduler.add_job(export_snapshot_wrapper, 'cron', hour=1, minute=30)
 
 # Вместо передачи готовой строки, передаем ключ 'report_1' для 12:00 и 'report_2' для 13:55.
 scheduler.add_job(
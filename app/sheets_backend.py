@@ -0,0 +1,279 @@
+# sheets_backend.py
+# Подменяемый бэкенд Google Sheets для export_google.py.
+#
+# export_google работает с объектом-клиентом, у которого есть open(title) -> таблица,
+# а у таблицы — worksheets(), add_worksheet(), batch_update(), values_batch_update(),
+# у листа — update(), batch_update(), clear(), add_rows(), hide(). Настоящий клиент —
+# gspread.Client; FakeSheetsClient реализует то же подмножество в памяти:
+#
+#   from app.sheets_backend import FakeSheetsClient
+#   fake = FakeSheetsClient(latency=0.05, quota_per_minute=60)
+#   export_google.use_sheets_backend(fake)
+#   ... fake.calls, fake.stats(), fake.open('...').worksheet('Data').get_all_values()
+#
+# Регрессионная проверка содержимого листов на этом бэкенде: python -m benchmarks.check_export
+import json
+import threading
+import time
+from collections import deque
+
+import gspread
+from gspread.utils import a1_range_to_grid_range
+
+
+class FakeResponse:
+    """Минимальный ответ API для gspread.exceptions.APIError."""
+
+    def __init__(self, status_code, message, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._payload = {'error': {'code': status_code, 'message': message, 'status': 'RESOURCE_EXHAUSTED'}}
+        self.text = json.dumps(self._payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeSheetsClient:
+    """
+    Клиент Google Sheets в памяти.
+
+    Каждый вызов API записывается в calls: операция, лист, число ячеек, размер
+    полезной нагрузки в байтах, задержка и статус. latency — искусственная задержка
+    на вызов (секунды); quota_per_minute — скользящая минутная квота, при превышении
+    вызов отвечает 429 с Retry-After; fail_every — каждый N-й вызов отвечает 429.
+    """
+
+    def __init__(self, latency=0.0, quota_per_minute=None, fail_every=0, retry_after=1):
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.fail_every = fail_every
+        self.retry_after = retry_after
+        self.calls = []
+        self._lock = threading.Lock()
+        self._window = deque()
+        self._spreadsheets = {}
+        self._next_sheet_id = 1
+
+    def open(self, title):
+        self._call('open', title, None)
+        with self._lock:
+            if title not in self._spreadsheets:
+                self._spreadsheets[title] = FakeSpreadsheet(self, title)
+            return self._spreadsheets[title]
+
+    def _new_sheet_id(self):
+        with self._lock:
+            sheet_id = self._next_sheet_id
+            self._next_sheet_id += 1
+            return sheet_id
+
+    def _call(self, op, sheet, payload, cells=0):
+        """Записать вызов, выдержать задержку и при необходимости ответить 429."""
+        size = len(json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')) if payload is not None else 0
+        with self._lock:
+            number = len(self.calls) + 1
+            now = time.monotonic()
+            while self._window and now - self._window[0] >= 60:
+                self._window.popleft()
+            throttled = (
+                (self.fail_every and number % self.fail_every == 0)
+                or (self.quota_per_minute is not None and len(self._window) >= self.quota_per_minute)
+            )
+            if not throttled:
+                self._window.append(now)
+            self.calls.append({
+                'op': op,
+                'sheet': sheet,
+                'cells': cells,
+                'bytes': size,
+                'latency': self.latency,
+                'status': 429 if throttled else 200,
+            })
+        if self.latency:
+            time.sleep(self.latency)
+        if throttled:
+            raise gspread.exceptions.APIError(
+                FakeResponse(429, 'Quota exceeded (fake)', {'Retry-After': str(self.retry_after)})
+            )
+
+    def stats(self):
+        """Сводка по вызовам: всего, по операциям, 429, ячейки и байты."""
+        with self._lock:
+            calls = list(self.calls)
+        by_op = {}
+        for call in calls:
+            by_op[call['op']] = by_op.get(call['op'], 0) + 1
+        return {
+            'calls': len(calls),
+            'by_op': by_op,
+            'throttled': sum(1 for call in calls if call['status'] == 429),
+            'cells': sum(call['cells'] for call in calls),
+            'bytes': sum(call['bytes'] for call in calls),
+        }
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = []
+            self._window.clear()
+
+
+def _count_cells(values):
+    return sum(len(row) for row in values)
+
+
+def _split_range(range_name):
+    """"'Лист'!A1:B2" -> ('Лист', 'A1:B2')."""
+    title, _, a1 = range_name.rpartition('!')
+    if title.startswith("'") and title.endswith("'"):
+        title = title[1:-1].replace("''", "'")
+    return title, a1
+
+
+class FakeSpreadsheet:
+
+    def __init__(self, client, title):
+        self.client = client
+        self.title = title
+        self._sheets = []
+        self._lock = threading.Lock()
+
+    def worksheets(self):
+        self.client._call('worksheets', None, None)
+        with self._lock:
+            return list(self._sheets)
+
+    def worksheet(self, title):
+        self.client._call('worksheet', title, None)
+        return self._find(title)
+
+    def _find(self, title):
+        with self._lock:
+            for ws in self._sheets:
+                if ws.title == title:
+                    return ws
+        raise gspread.exceptions.WorksheetNotFound(title)
+
+    def _find_by_id(self, sheet_id):
+        with self._lock:
+            for ws in self._sheets:
+                if ws.id == sheet_id:
+                    return ws
+        return None
+
+    def add_worksheet(self, title, rows, cols):
+        self.client._call('add_worksheet', title, {'title': title, 'rows': rows, 'cols': cols})
+        with self._lock:
+            if any(ws.title == title for ws in self._sheets):
+                raise gspread.exceptions.APIError(
+                    FakeResponse(400, f'A sheet with the name "{title}" already exists.')
+                )
+            ws = FakeWorksheet(self, self.client._new_sheet_id(), title, int(rows), int(cols))
+            self._sheets.append(ws)
+            return ws
+
+    def batch_update(self, body):
+        requests = body.get('requests', [])
+        self.client._call('batch_update', None, body)
+        for request in requests:
+            if 'updateCells' in request:
+                ws = self._find_by_id(request['updateCells']['range']['sheetId'])
+                if ws is not None:
+                    ws._cells.clear()
+            elif 'updateSheetProperties' in request:
+                props = request['updateSheetProperties']['properties']
+                ws = self._find_by_id(props['sheetId'])
+                if ws is not None:
+                    ws._properties['gridProperties'].update(props.get('gridProperties', {}))
+                    if 'hidden' in props:
+                        ws._properties['hidden'] = props['hidden']
+        return {'replies': [{} for _ in requests]}
+
+    def values_batch_update(self, body):
+        data = body.get('data', [])
+        self.client._call('values_batch_update', None, body, cells=sum(_count_cells(d['values']) for d in data))
+        user_entered = body.get('valueInputOption') == 'USER_ENTERED'
+        for item in data:
+            title, a1 = _split_range(item['range'])
+            self._find(title)._write(a1, item['values'], user_entered)
+        return {'totalUpdatedCells': sum(_count_cells(d['values']) for d in data)}
+
+
+class FakeWorksheet:
+
+    def __init__(self, spreadsheet, sheet_id, title, rows, cols):
+        self.spreadsheet = spreadsheet
+        self._properties = {
+            'sheetId': sheet_id,
+            'title': title,
+            'gridProperties': {'rowCount': rows, 'columnCount': cols},
+        }
+        self._cells = {}    # {(row, col): value}, с нуля
+
+    @property
+    def id(self):
+        return self._properties['sheetId']
+
+    @property
+    def title(self):
+        return self._properties['title']
+
+    @property
+    def row_count(self):
+        return self._properties['gridProperties']['rowCount']
+
+    @property
+    def col_count(self):
+        return self._properties['gridProperties']['columnCount']
+
+    def _write(self, a1, values, user_entered=False):
+        grid = a1_range_to_grid_range(a1) if a1 else {}
+        top = grid.get('startRowIndex', 0)
+        left = grid.get('startColumnIndex', 0)
+        for r, row in enumerate(values):
+            for c, value in enumerate(row):
+                if user_entered and isinstance(value, str) and value.startswith("'"):
+                    value = value[1:]
+                self._cells[(top + r, left + c)] = value
+        # values.update расширяет сетку под записанные данные
+        grid_props = self._properties['gridProperties']
+        grid_props['rowCount'] = max(grid_props['rowCount'], top + len(values))
+        grid_props['columnCount'] = max(grid_props['columnCount'], left + max((len(row) for row in values), default=0))
+
+    def update(self, values=None, range_name=None, **kwargs):
+        # gspread 6 принимает и старый порядок аргументов: update('A1', [[...]])
+        if isinstance(values, str):
+            values, range_name = range_name, values
+        self.spreadsheet.client._call('update', self.title, values, cells=_count_cells(values))
+        self._write(range_name or 'A1', values, kwargs.get('value_input_option') == 'USER_ENTERED')
+        return {'updatedCells': _count_cells(values)}
+
+    def batch_update(self, data, **kwargs):
+        self.spreadsheet.client._call('ws_batch_update', self.title, data,
+                                      cells=sum(_count_cells(d['values']) for d in data))
+        for item in data:
+            self._write(item['range'], item['values'], kwargs.get('value_input_option') == 'USER_ENTERED')
+        return {'totalUpdatedCells': sum(_count_cells(d['values']) for d in data)}
+
+    def clear(self):
+        self.spreadsheet.client._call('clear', self.title, None)
+        self._cells.clear()
+
+    def add_rows(self, rows):
+        self.spreadsheet.client._call('add_rows', self.title, {'rows': rows})
+        self._properties['gridProperties']['rowCount'] += rows
+
+    def hide(self):
+        self.spreadsheet.client._call('hide', self.title, None)
+        self._properties['hidden'] = True
+
+    def get_all_values(self):
+        """Содержимое листа двумерным списком (без вызова API, для проверок)."""
+        if not self._cells:
+            return []
+        rows = max(r for r, _ in self._cells) + 1
+        cols = max(c for _, c in self._cells) + 1
+        values = [[''] * cols for _ in range(rows)]
+        for (r, c), value in self._cells.items():
+            values[r][c] = value
+        return values
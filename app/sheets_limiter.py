@@ -0,0 +1,140 @@
+# sheets_limiter.py
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+# Квоты Google Sheets API на пользователя (сервисный аккаунт): запросов в минуту
+SHEETS_READ_PER_MINUTE = 60
+SHEETS_WRITE_PER_MINUTE = 60
+# Сколько запросов можно отправить подряд без паузы
+SHEETS_BURST = 10
+# Усечённый экспоненциальный откат при 429: min(base * 2^n, max) + случайная добавка
+SHEETS_BACKOFF_BASE_SECONDS = 2
+SHEETS_BACKOFF_MAX_SECONDS = 64
+SHEETS_BACKOFF_JITTER_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше capacity в запасе."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def reserve(self, now):
+        """
+        Забрать маркер (при нехватке — в долг).
+
+        Returns:
+            float: Сколько секунд подождать до отправки запроса.
+        """
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+
+class SheetsRateLimiter:
+    """
+    Общий на процесс ограничитель запросов к Google Sheets.
+
+    Каждый запрос сначала берёт маркер из ведра чтения или записи, поэтому
+    экспорт, приём лидов и хендлеры вместе держатся ниже минутной квоты.
+    После 429 pause() останавливает все потоки до истечения Retry-After
+    (или отката с джиттером), а не только тот, что получил ошибку.
+    """
+
+    def __init__(self, read_per_minute=SHEETS_READ_PER_MINUTE,
+                 write_per_minute=SHEETS_WRITE_PER_MINUTE, burst=SHEETS_BURST):
+        self._lock = threading.Lock()
+        self.configure(read_per_minute, write_per_minute, burst)
+        self._paused_until = 0.0
+
+        self.acquired = 0
+        self.throttled = 0
+        self.waited_total = 0.0
+
+    def configure(self, read_per_minute=SHEETS_READ_PER_MINUTE,
+                  write_per_minute=SHEETS_WRITE_PER_MINUTE, burst=SHEETS_BURST):
+        """
+        Сменить квоты на работающем ограничителе (например, в бенчмарке или при
+        повышенной квоте проекта). Вёдра начинают полными, пауза после 429 сохраняется.
+        """
+        with self._lock:
+            self._buckets = {
+                'read': TokenBucket(read_per_minute / 60, burst),
+                'write': TokenBucket(write_per_minute / 60, burst),
+            }
+
+    def _reserve(self, kind):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._buckets[kind].reserve(now)
+            delay = max(delay, self._paused_until - now)
+            self.acquired += 1
+            self.waited_total += delay
+            return delay
+
+    def acquire(self, kind='write'):
+        """Дождаться права на запрос (блокирует поток)."""
+        delay = self._reserve(kind)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, kind='write'):
+        """То же, что acquire(), но не блокирует цикл событий."""
+        delay = self._reserve(kind)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds):
+        """Приостановить все запросы на seconds секунд (после 429)."""
+        with self._lock:
+            self.throttled += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        logging.warning(f"Квота Google Sheets исчерпана, пауза {seconds:.1f} с.")
+
+    @staticmethod
+    def backoff_delay(attempt, retry_after=None):
+        """
+        Пауза перед повтором: Retry-After, если сервер его прислал, иначе
+        усечённый экспоненциальный откат с джиттером.
+        """
+        if retry_after is not None:
+            return retry_after
+        delay = min(SHEETS_BACKOFF_BASE_SECONDS * 2 ** attempt, SHEETS_BACKOFF_MAX_SECONDS)
+        return delay + random.uniform(0, SHEETS_BACKOFF_JITTER_SECONDS)
+
+    @staticmethod
+    def parse_retry_after(response):
+        """Retry-After из ответа в секундах (число или HTTP-дата), либо None."""
+        value = response.headers.get('Retry-After') if response is not None else None
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "acquired": self.acquired,
+                "throttled": self.throttled,
+                "waited_total_s": round(self.waited_total, 2),
+                "paused_for_s": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            }
+
+
+sheets_limiter = SheetsRateLimiter()
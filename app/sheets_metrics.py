@@ -0,0 +1,131 @@
+# sheets_metrics.py
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from config import API_TOKEN
+
+# Отправлять ли сводку каждого экспорта в лог-чат и в какой
+SHEETS_REPORT_TO_CHAT = False
+SHEETS_REPORT_CHAT_ID = -4529397186
+# Сколько самых медленных вызовов показывать в отчёте
+SHEETS_REPORT_SLOWEST = 5
+
+
+def payload_size(payload):
+    """(ячеек, байт) полезной нагрузки запроса: списки строк значений или тело batchUpdate."""
+    if payload is None:
+        return 0, 0
+    size = len(json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8'))
+    if isinstance(payload, dict) and 'data' in payload:
+        rows = [row for item in payload['data'] for row in item.get('values', [])]
+    elif isinstance(payload, list) and payload and isinstance(payload[0], dict):
+        rows = [row for item in payload for row in item.get('values', [])]
+    elif isinstance(payload, list):
+        rows = payload
+    else:
+        rows = []
+    cells = sum(len(row) for row in rows if isinstance(row, (list, tuple)))
+    return cells, size
+
+
+class SheetsMetrics:
+    """
+    Учёт вызовов Google Sheets API за прогон экспорта.
+
+    execute_with_retry сообщает о каждом вызове: операция, лист, ячейки и байты,
+    время, число повторов и 429. start_run()/finish_run() обрамляют прогон,
+    finish_run() возвращает структурированный отчёт и пишет его в лог.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = []
+        self._run_name = None
+        self._run_started = None
+
+    def start_run(self, name):
+        with self._lock:
+            self._calls = []
+            self._run_name = name
+            self._run_started = time.monotonic()
+
+    def record(self, op, sheet=None, cells=0, size=0, latency=0.0, wait=0.0, retries=0, throttled=0, error=None):
+        with self._lock:
+            self._calls.append({
+                'op': op,
+                'sheet': sheet,
+                'cells': cells,
+                'bytes': size,
+                'latency_s': round(latency, 3),
+                'wait_s': round(wait, 3),
+                'retries': retries,
+                'throttled': throttled,
+                'error': error,
+            })
+
+    def report(self):
+        """Отчёт по вызовам с начала прогона."""
+        with self._lock:
+            calls = list(self._calls)
+            name = self._run_name
+            started = self._run_started
+        by_op = {}
+        for call in calls:
+            op = by_op.setdefault(call['op'], {'calls': 0, 'cells': 0, 'bytes': 0, 'latency_s': 0.0})
+            op['calls'] += 1
+            op['cells'] += call['cells']
+            op['bytes'] += call['bytes']
+            op['latency_s'] = round(op['latency_s'] + call['latency_s'], 3)
+        return {
+            'run': name,
+            'wall_s': round(time.monotonic() - started, 3) if started is not None else None,
+            'calls': len(calls),
+            'cells': sum(call['cells'] for call in calls),
+            'bytes': sum(call['bytes'] for call in calls),
+            'api_time_s': round(sum(call['latency_s'] for call in calls), 3),
+            'limiter_wait_s': round(sum(call['wait_s'] for call in calls), 3),
+            'retries': sum(call['retries'] for call in calls),
+            'throttled': sum(call['throttled'] for call in calls),
+            'errors': sum(1 for call in calls if call['error']),
+            'by_op': by_op,
+            'slowest': sorted(calls, key=lambda call: call['latency_s'], reverse=True)[:SHEETS_REPORT_SLOWEST],
+        }
+
+    def finish_run(self, post_to_chat=None):
+        """Завершить прогон: отчёт в лог и, если включено (SHEETS_REPORT_TO_CHAT), в лог-чат."""
+        report = self.report()
+        logging.info(f"Отчёт экспорта Google Sheets: {json.dumps(report, ensure_ascii=False)}")
+        if SHEETS_REPORT_TO_CHAT if post_to_chat is None else post_to_chat:
+            post_report(report)
+        return report
+
+
+def format_report(report):
+    """Короткая сводка отчёта для чата."""
+    lines = [
+        f"Экспорт Google Sheets: {report['run']}",
+        f"Время: {report['wall_s']} с (API {report['api_time_s']} с, ожидание квоты {report['limiter_wait_s']} с)",
+        f"Вызовов: {report['calls']}, повторов: {report['retries']}, 429: {report['throttled']}, ошибок: {report['errors']}",
+        f"Отправлено: {report['cells']} ячеек, {report['bytes'] / 1024:.1f} КБ",
+    ]
+    for op, stats in sorted(report['by_op'].items(), key=lambda item: -item[1]['latency_s']):
+        lines.append(f"  {op}: {stats['calls']} выз., {stats['latency_s']} с")
+    return '\n'.join(lines)
+
+
+def post_report(report, chat_id=SHEETS_REPORT_CHAT_ID):
+    """Отправить сводку в лог-чат. Экспорт идёт в рабочем потоке, поэтому запрос синхронный."""
+    url = f"https://api.telegram.org/bot{API_TOKEN}/sendMessage"
+    try:
+        response = requests.post(url, data={'chat_id': chat_id, 'text': format_report(report)}, timeout=10)
+        if response.status_code != 200:
+            logging.error(f"Не удалось отправить отчёт экспорта: {response.text}")
+    except Exception as e:
+        logging.error(f"Не удалось отправить отчёт экспорта: {e}")
+
+
+sheets_metrics = SheetsMetrics()
@@ -0,0 +1,160 @@
+# sheets_sync.py
+import asyncio
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime
+
+import export_google
+
+# Не чаще одного обновления Google Sheets за это окно (в секундах)
+SHEETS_SYNC_WINDOW_SECONDS = 30
+
+
+class ExportJob:
+    """
+    Задача экспорта в Google Sheets: объединённые стадии всех склеенных запросов.
+
+    Можно дождаться из корутины (await job) или из потока (job.result()).
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.stages = set()
+        self.force = False
+        self.requests = 0
+        self.state = 'queued'
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.error = None
+        self.report = None
+        self._future = Future()
+
+    def merge(self, stages, force):
+        self.stages.update(stages)
+        self.force = self.force or force
+        self.requests += 1
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout=None):
+        """Дождаться завершения (блокирует поток). Returns: отчёт sheets_metrics."""
+        return self._future.result(timeout)
+
+    def __await__(self):
+        return asyncio.wrap_future(self._future).__await__()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'state': self.state,
+            'stages': [stage for stage in export_google.EXPORT_STAGES if stage in self.stages],
+            'force': self.force,
+            'requests': self.requests,
+            'created_at': self.created_at.isoformat(timespec='seconds'),
+            'started_at': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+            'finished_at': self.finished_at.isoformat(timespec='seconds') if self.finished_at else None,
+            'error': str(self.error) if self.error else None,
+        }
+
+
+class SheetsSyncCoordinator:
+    """
+    Единственная точка запуска экспорта в Google Sheets (single-flight).
+
+    Одновременно выполняется не больше одной задачи и ждёт не больше одной:
+    все запросы, пришедшие до её старта, сливаются в неё (стадии объединяются,
+    force — если хоть один запрос его просил). Задача стартует не чаще одного
+    раза за window секунд. mark_dirty() возвращает ExportJob, которую можно
+    дождаться; status() показывает текущую, ожидающую и последнюю задачи.
+    """
+
+    def __init__(self, window=SHEETS_SYNC_WINDOW_SECONDS):
+        self.window = window
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._queued = None
+        self._running = None
+        self._last = None
+        self._timer = None
+        self._last_run = None
+
+    def mark_dirty(self, stages=None, force=False):
+        """
+        Запросить экспорт. Можно вызывать из любого потока.
+
+        Args:
+            stages: Стадии экспорта (export_google.DATA_STAGES, ALL_STAGES, FORMATTING_STAGES...).
+                По умолчанию — export_google.data_change_stages(): данные, а в режиме
+                'materialized' ещё и содержимое листов.
+            force: Пересобрать листы, даже если хеш шаблона не изменился.
+
+        Returns:
+            ExportJob: Ожидающая задача, в которую слит этот запрос.
+        """
+        if stages is None:
+            stages = export_google.data_change_stages()
+        with self._lock:
+            if self._queued is None:
+                self._queued = ExportJob(next(self._ids))
+            job = self._queued
+            job.merge(stages, force)
+            if self._timer is None and self._running is None:
+                self._schedule()
+        return job
+
+    def status(self):
+        with self._lock:
+            return {
+                'running': self._running.to_dict() if self._running else None,
+                'queued': self._queued.to_dict() if self._queued else None,
+                'last': self._last.to_dict() if self._last else None,
+            }
+
+    def _schedule(self):
+        delay = 0.0
+        if self._last_run is not None:
+            delay = max(0.0, self._last_run + self.window - time.monotonic())
+        self._timer = threading.Timer(delay, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+            job = self._queued
+            if job is None:
+                return
+            self._queued = None
+            self._running = job
+            job.state = 'running'
+            job.started_at = datetime.now()
+            self._last_run = time.monotonic()
+
+        logging.info(f"Экспорт Google Sheets #{job.id} ({', '.join(sorted(job.stages))}), "
+                     f"запросов склеено: {job.requests}")
+        try:
+            job.report = export_google.run_export(job.stages, force=job.force)
+        except Exception as e:
+            logging.error(f"Ошибка экспорта Google Sheets #{job.id}: {e}")
+            job.error = e
+        finally:
+            with self._lock:
+                job.state = 'failed' if job.error else 'done'
+                job.finished_at = datetime.now()
+                self._running = None
+                self._last = job
+                if self._queued is not None:
+                    self._schedule()
+
+        if job.error is None:
+            job._future.set_result(job.report)
+        else:
+            job._future.set_exception(job.error)
+
+
+sheets_sync = SheetsSyncCoordinator()
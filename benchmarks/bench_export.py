@@ -0,0 +1,200 @@
+# bench_export.py
+# Бенчмарк выгрузки в Google Sheets на синтетических данных и фейковом бэкенде.
+#
+# Для каждого масштаба (сотрудников x лет истории) в отдельном процессе создаётся
+# временная SQLite-база, заполняется names/user_info, и выгрузка прогоняется
+# против FakeSheetsClient. Меряются время, число SQL-запросов, вызовов Sheets API,
+# отправленные байты и пиковая память процесса. Результат — JSON.
+#
+#   python -m benchmarks.bench_export --scales 10x1,50x3,200x5 --output bench_export.json
+#   python -m benchmarks.bench_export --baseline bench_export.json   # сравнить с прошлым прогоном
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+DEFAULT_SCALES = '10x1,50x3,200x5'
+# Во сколько раз метрика может вырасти относительно базового прогона, прежде чем это регрессия
+REGRESSION_TOLERANCE = 1.2
+REGRESSION_METRICS = ('wall_s', 'db_queries', 'api_calls', 'bytes_uploaded')
+
+NAMES_DDL = '''
+CREATE TABLE IF NOT EXISTS names (
+    id INTEGER PRIMARY KEY,
+    username TEXT,
+    real_name TEXT,
+    real_user_id INTEGER,
+    rank INTEGER,
+    group_id INTEGER,
+    language TEXT
+)
+'''
+
+
+def seed(engine, staff, years, seed_value=1):
+    """Заполнить names и user_info: staff сотрудников, рабочие дни за years лет."""
+    from sqlalchemy import text
+
+    rnd = random.Random(seed_value)
+    names = []
+    for i in range(staff):
+        rank = 1 if i % 10 < 7 else (2 if i % 10 < 9 else 3)
+        names.append({'username': f'user{i}', 'real_name': f'Сотрудник {i:03d}', 'real_user_id': i + 1,
+                      'rank': rank, 'group_id': -1000 - i, 'language': 'ru'})
+
+    first_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=365 * years)
+    records = []
+    for offset in range(365 * years):
+        day = first_day + timedelta(days=offset)
+        if day.weekday() >= 5:
+            continue
+        for name in names:
+            if rnd.random() < 0.1:
+                continue
+            start = day + timedelta(hours=9, minutes=rnd.randrange(60))
+            end = start + timedelta(hours=8, minutes=rnd.randrange(90)) if rnd.random() > 0.05 else None
+            records.append({'user_id': name['real_user_id'], 'date': start, 'start_time': start, 'end_time': end,
+                            'leads': rnd.randrange(15), 'has_photo': int(rnd.random() > 0.3), 'day': day.date()})
+
+    with engine.begin() as conn:
+        conn.execute(text(NAMES_DDL))
+        conn.execute(text(
+            'INSERT INTO names (username, real_name, real_user_id, rank, group_id, language) '
+            'VALUES (:username, :real_name, :real_user_id, :rank, :group_id, :language)'
+        ), names)
+        conn.execute(text(
+            'INSERT INTO user_info (user_id, date, start_time, end_time, leads, has_photo, day) '
+            'VALUES (:user_id, :date, :start_time, :end_time, :leads, :has_photo, :day)'
+        ), records)
+    return len(records)
+
+
+def run_scale(staff, years, latency):
+    """Один масштаб в текущем процессе (DATABASE_URL уже указывает на временную базу)."""
+    from sqlalchemy import event
+
+    from app.database.engine import engine
+    import app.database.models  # noqa: F401 — создаёт user_info и служебные таблицы
+
+    rows = seed(engine, staff, years)
+
+    import export_google
+    from app.sheets_backend import FakeSheetsClient
+
+    # Квоту здесь не моделируем — меряем саму выгрузку, а не ожидание маркеров
+    export_google.sheets_limiter.configure(read_per_minute=10 ** 6, write_per_minute=10 ** 6, burst=10 ** 6)
+    fake = FakeSheetsClient(latency=latency)
+    export_google.use_sheets_backend(fake)
+
+    queries = [0]
+    event.listen(engine, 'before_cursor_execute', lambda *args: queries.__setitem__(0, queries[0] + 1))
+
+    def measure(name, coro_factory):
+        fake.reset_calls()
+        queries[0] = 0
+        started = time.perf_counter()
+        asyncio.run(coro_factory())
+        wall = time.perf_counter() - started
+        stats = fake.stats()
+        return {
+            'run': name,
+            'wall_s': round(wall, 3),
+            'db_queries': queries[0],
+            'api_calls': stats['calls'],
+            'api_throttled': stats['throttled'],
+            'api_by_op': stats['by_op'],
+            'cells_uploaded': stats['cells'],
+            'bytes_uploaded': stats['bytes'],
+        }
+
+    runs = [
+        measure('update_all_data (cold)', export_google.update_all_data),
+        measure('update_all_data (warm)', export_google.update_all_data),
+        measure('update_user_data', export_google.update_user_data),
+    ]
+    return {
+        'scale': f'{staff}x{years}',
+        'staff': staff,
+        'years': years,
+        'user_info_rows': rows,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'runs': runs,
+    }
+
+
+def run_scale_subprocess(staff, years, latency):
+    """Каждый масштаб — в своём процессе: своя база, свой движок и честная пиковая память."""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        result = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.bench_export', '--child', f'{staff}x{years}', '--latency', str(latency)],
+            env=env, capture_output=True, text=True, check=True
+        )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline):
+    """Список регрессий относительно базового прогона (по совпадающим масштабам и прогонам)."""
+    base_runs = {
+        (scale['scale'], run['run']): run for scale in baseline['scales'] for run in scale['runs']
+    }
+    regressions = []
+    for scale in results['scales']:
+        for run in scale['runs']:
+            base = base_runs.get((scale['scale'], run['run']))
+            if base is None:
+                continue
+            for metric in REGRESSION_METRICS:
+                if base[metric] and run[metric] > base[metric] * REGRESSION_TOLERANCE:
+                    regressions.append(f"{scale['scale']} / {run['run']}: {metric} {base[metric]} -> {run[metric]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк выгрузки в Google Sheets')
+    parser.add_argument('--scales', default=DEFAULT_SCALES, help='сотрудников x лет через запятую, например 10x1,50x3')
+    parser.add_argument('--latency', type=float, default=0.0, help='искусственная задержка на вызов API, с')
+    parser.add_argument('--output', help='куда сохранить JSON с результатами')
+    parser.add_argument('--baseline', help='JSON прошлого прогона; при регрессии код выхода 1')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        staff, years = map(int, args.child.split('x'))
+        # Выгрузка печатает прогресс в stdout; результат — последней строкой
+        result = run_scale(staff, years, args.latency)
+        print(json.dumps(result, ensure_ascii=False))
+        return
+
+    results = {'created_at': datetime.now().isoformat(timespec='seconds'), 'latency_s': args.latency, 'scales': []}
+    for scale in args.scales.split(','):
+        staff, years = map(int, scale.split('x'))
+        result = run_scale_subprocess(staff, years, args.latency)
+        results['scales'].append(result)
+        for run in result['runs']:
+            print(f"{result['scale']:>7} {run['run']:<24} {run['wall_s']:>8.3f} с  "
+                  f"SQL {run['db_queries']:>4}  API {run['api_calls']:>4}  "
+                  f"{run['bytes_uploaded'] / 1024:>9.1f} КБ  RSS {result['peak_rss_mb']} МБ")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f))
+        for line in regressions:
+            print(f"РЕГРЕССИЯ: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+# bench_export_format.py
+# Сравнение построчного форматирования выгрузки (как было) с векторным (pandas).
+#
+#   python -m benchmarks.bench_export_format [--rows 100000] [--users 200]
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from export_google import (
+    MONTHS_RU_ORDER, format_export_frame, summarize_export_frame, build_data_rows
+)
+from config import MONTHS_EN_TO_RU
+
+
+def make_raw_frame(rows, users, seed=42):
+    """Синтетическая выборка user_info ⋈ names в том же виде, что возвращает load_export_frame()."""
+    rnd = random.Random(seed)
+    names = [f"Сотрудник {i}" for i in range(users)]
+    ranks = [rnd.choice((1, 1, 1, 2, 3)) for _ in range(users)]
+    first_day = datetime(2021, 1, 1)
+    records = []
+    for i in range(rows):
+        u = rnd.randrange(users)
+        day = first_day + timedelta(days=rnd.randrange(4 * 365))
+        start = day + timedelta(hours=8, minutes=rnd.randrange(180)) if rnd.random() > 0.05 else None
+        end = start + timedelta(hours=8, minutes=rnd.randrange(120)) if start and rnd.random() > 0.1 else None
+        records.append((names[u], ranks[u], day, start, end, rnd.randrange(20), rnd.choice((0, 1))))
+    return pd.DataFrame(records, columns=['real_name', 'rank', 'date', 'start_time', 'end_time', 'leads', 'has_photo'])
+
+
+def legacy_collect(raw):
+    """Построчная реализация (strftime на каждую строку, strptime ради года, множества по пользователям)."""
+    all_data, manager_names, manager_months, manager_years, validator_data = [], [], {}, {}, []
+    for real_name, rank, date_obj, start_time, end_time, leads, has_photo in raw.itertuples(index=False, name=None):
+        month_en = date_obj.strftime('%B')
+        fd = [
+            MONTHS_EN_TO_RU.get(month_en, month_en),
+            date_obj.strftime('%d/%m/%Y'),
+            start_time.strftime('%H:%M') if pd.notna(start_time) else '',
+            end_time.strftime('%H:%M') if pd.notna(end_time) else '',
+            leads,
+            '+' if has_photo == 1 else '-',
+        ]
+        all_data.append([real_name] + fd)
+        if rank == 1:
+            if real_name not in manager_months:
+                manager_names.append(real_name)
+                manager_months[real_name] = set()
+                manager_years[real_name] = set()
+            manager_months[real_name].add(fd[0])
+            manager_years[real_name].add(fd[1].split('/')[-1])
+        elif rank == 2:
+            validator_data.append([real_name] + fd)
+    for real_name in manager_names:
+        manager_months[real_name] = sorted(manager_months[real_name], key=lambda m: MONTHS_RU_ORDER.get(m, 0))
+        manager_years[real_name] = sorted(manager_years[real_name])
+
+    data_rows = []
+    for row in all_data:
+        year = datetime.strptime(row[2], '%d/%m/%Y').year
+        data_rows.append(row[:6] + [str(year), row[6]])
+    return (all_data, manager_names, manager_months, manager_years, validator_data), data_rows
+
+
+def vectorized_collect(raw):
+    result = summarize_export_frame(format_export_frame(raw))
+    return result, build_data_rows(result[0])
+
+
+def timed(func, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Форматирование выгрузки: построчно vs pandas')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    raw = make_raw_frame(args.rows, args.users)
+    legacy_time, legacy = timed(legacy_collect, raw, repeat=args.repeat)
+    vector_time, vector = timed(vectorized_collect, raw, repeat=args.repeat)
+
+    if legacy != vector:
+        raise SystemExit("Результаты построчной и векторной реализаций не совпадают")
+
+    print(f"Строк: {args.rows}, сотрудников: {args.users} (лучшее из {args.repeat})")
+    print(f"  построчно: {legacy_time:.3f} с")
+    print(f"  векторно:  {vector_time:.3f} с")
+    print(f"  ускорение: x{legacy_time / vector_time:.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+# check_export.py
+# Регрессионная проверка выгрузки в Google Sheets без сети: update_all_data и
+# update_user_data прогоняются против FakeSheetsClient на временной SQLite-базе,
+# после чего содержимое листов сверяется с ожидаемым, посчитанным прямо по БД.
+#
+#   python -m benchmarks.check_export        # код выхода 1, если что-то не совпало
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from datetime import datetime
+
+STAFF = 12
+YEARS = 1
+
+
+def expected_data_rows(db_path):
+    """Строки листа Data, посчитанные независимо от export_google: прямым SQL и strftime."""
+    from config import MONTHS_EN_TO_RU
+
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        'SELECT n.real_name, u.date, u.start_time, u.end_time, u.leads, u.has_photo '
+        'FROM user_info u JOIN names n ON n.real_user_id = u.user_id ORDER BY u.id'
+    ).fetchall()
+    conn.close()
+
+    def hhmm(value):
+        return datetime.fromisoformat(value).strftime('%H:%M') if value else ''
+
+    expected = []
+    for real_name, date, start, end, leads, has_photo in rows:
+        day = datetime.fromisoformat(date)
+        month = day.strftime('%B')
+        expected.append([
+            real_name, MONTHS_EN_TO_RU.get(month, month), day.strftime('%d/%m/%Y'),
+            hhmm(start), hhmm(end), leads or 0, str(day.year), '+' if has_photo == 1 else '-'
+        ])
+    return expected
+
+
+def first_mismatch(actual, expected):
+    """Описание первой несовпавшей строки листа."""
+    for position, (got, want) in enumerate(zip(actual, expected)):
+        if got != want:
+            return f"строка {position + 2}: {got} вместо {want}"
+    return f"{len(actual)} строк вместо {len(expected)}"
+
+
+def staff_by_rank(db_path):
+    """{rank: имена} сотрудников с записями, в порядке их первой записи (как на листах)."""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        'SELECT n.real_name, n.rank FROM names n JOIN user_info u ON u.user_id = n.real_user_id '
+        'GROUP BY n.real_user_id ORDER BY MIN(u.id)'
+    ).fetchall()
+    conn.close()
+    return {rank: [name for name, r in rows if r == rank] for rank in (1, 2, 3)}
+
+
+def run_checks(db_path):
+    """Список расхождений (пустой — всё в порядке)."""
+    from app.database.engine import engine
+    import app.database.models  # noqa: F401 — создаёт user_info и служебные таблицы
+    from benchmarks.bench_export import seed
+
+    seed(engine, STAFF, YEARS)
+
+    import export_google
+    from app.sheets_backend import FakeSheetsClient
+
+    export_google.sheets_limiter.configure(read_per_minute=10 ** 6, write_per_minute=10 ** 6, burst=10 ** 6)
+    fake = FakeSheetsClient()
+    export_google.use_sheets_backend(fake)
+
+    failures = []
+
+    def check(condition, message):
+        if not condition:
+            failures.append(message)
+
+    def sheet(title):
+        return fake.open(export_google.GOOGLE_SHEET)._find(title)
+
+    # Холодный прогон: все листы создаются с нуля
+    asyncio.run(export_google.update_all_data())
+    expected = expected_data_rows(db_path)
+    data = sheet('Data').get_all_values()
+    check(data[:1] == [export_google.DATA_HEADERS], f"Data: заголовки {data[:1]}")
+    check(data[1:] == expected, f"Data: {first_mismatch(data[1:], expected)}")
+    check(sheet('Data')._properties.get('hidden') is True, "Data: лист не скрыт")
+
+    staff = staff_by_rank(db_path)
+    main = sheet('Основная страница').get_all_values()
+    check(main[0][0] == 'Общая информация', f"Основная страница: A1 = {main[0][0]!r}")
+    check([row[0] for row in main[2:2 + len(staff[1])]] == staff[1],
+          "Основная страница: список менеджеров в A3 не совпадает")
+    check(sheet('Валидаторы').get_all_values()[0][0] == 'Валидаторы', "Валидаторы: A1")
+    for name in staff[1]:
+        check(sheet(name).get_all_values()[0][0] == name, f"{name}: A1")
+    for name in staff[3]:
+        try:
+            sheet(name)
+            failures.append(f"{name}: у РОП не должно быть своего листа")
+        except Exception:
+            pass
+
+    # Повторный прогон без изменений: только запрос метаданных листов
+    fake.reset_calls()
+    asyncio.run(export_google.update_all_data())
+    check(fake.stats()['by_op'] == {'worksheets': 1}, f"Тёплый прогон: вызовы {fake.stats()['by_op']}")
+
+    # Изменение одной записи доходит до Data точечной записью
+    conn = sqlite3.connect(db_path)
+    conn.execute('UPDATE user_info SET leads = leads + 100 WHERE id = (SELECT MIN(id) FROM user_info)')
+    conn.commit()
+    conn.close()
+    fake.reset_calls()
+    asyncio.run(export_google.update_user_data())
+    expected = expected_data_rows(db_path)
+    data = sheet('Data').get_all_values()
+    check(data[1:] == expected, f"Data после изменения записи: {first_mismatch(data[1:], expected)}")
+    check('ws_batch_update' in fake.stats()['by_op'] and 'clear' not in fake.stats()['by_op'],
+          f"Data после изменения: ожидалась точечная запись, вызовы {fake.stats()['by_op']}")
+    return failures
+
+
+def main():
+    if os.environ.get('CHECK_EXPORT_CHILD'):
+        failures = run_checks(os.environ['CHECK_EXPORT_DB'])
+        for line in failures:
+            print(f"ОШИБКА: {line}")
+        print("Проверка выгрузки: OK" if not failures else f"Проверка выгрузки: {len(failures)} ошибок")
+        sys.exit(1 if failures else 0)
+
+    # Движок БД создаётся при импорте, поэтому проверка идёт в отдельном процессе
+    # со своей временной базой
+    import subprocess
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'check.db')
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', CHECK_EXPORT_CHILD='1', CHECK_EXPORT_DB=db_path)
+        result = subprocess.run([sys.executable, '-m', 'benchmarks.check_export'], env=env)
+    sys.exit(result.returncode)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,42 @@
 import gspread
+import hashlib
+import json
+import threading
 import time
 import asyncio
 from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
+
+from gspread.utils import absolute_range_name, rowcol_to_a1
 from oauth2client.service_account import ServiceAccountCredentials
-from sqlalchemy import create_engine, Table, MetaData
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import select
+from sqlalchemy import Table, MetaData
+from sqlalchemy.sql import select, insert, update, delete
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
 from gspread_formatting import (
     format_cell_range, CellFormat, TextFormat, Color, Borders, Border
 )
-from config import JSON_FILE, GOOGLE_SHEET, MONTHS_EN_TO_RU, DATABASE_URL
+from app.database.engine import engine, Session
+from app.sheets_limiter import sheets_limiter
+from app.sheets_metrics import sheets_metrics, payload_size
+from app.database.models import DataSheetSnapshot, SheetTemplateFingerprint
+from config import JSON_FILE, GOOGLE_SHEET, MONTHS_EN_TO_RU
+
+# Сколько раз повторять запрос к Google Sheets после 429 или временной ошибки сервера
+SHEETS_MAX_RETRIES = 8
+# Временные ошибки сервера, после которых запрос повторяется с откатом (без общей паузы)
+SHEETS_RETRY_STATUSES = (500, 502, 503, 504)
+
+# Режим листов менеджеров, валидаторов и «Основной страницы»:
+# 'formulas' — формулы FILTER/MAP по листу Data (считает Google Sheets);
+# 'materialized' — готовые значения, посчитанные здесь, блоками по месяцам.
+EXPORT_MODE = 'formulas'
+# Первая строка (листы менеджеров/валидаторов) и первая колонка (F на «Основной странице»)
+# скрытых блоков с готовыми значениями
+MATERIALIZED_BLOCK_ROW = 10
+MATERIALIZED_BLOCK_COL = 6
 
 MONTHS_RU_ORDER = {
     'Январь': 1,
@@ -28,11 +53,13 @@ MONTHS_RU_ORDER = {
     'Декабрь': 12
 }
 
-executor = ThreadPoolExecutor()
+# Листы менеджеров, «Валидаторы» и «Основная страница» собираются и отправляются
+# параллельно: не больше SHEETS_EXPORT_WORKERS одновременных запросов (квоту
+# по-прежнему держит sheets_limiter), не больше SHEETS_BATCH_SHEETS листов в пакете
+SHEETS_EXPORT_WORKERS = 4
+SHEETS_BATCH_SHEETS = 20
+sheets_pool = ThreadPoolExecutor(max_workers=SHEETS_EXPORT_WORKERS, thread_name_prefix='sheets-export')
 
-engine = create_engine(DATABASE_URL)
-Session = sessionmaker(bind=engine)
-session = Session()
 metadata = MetaData()
 metadata.reflect(bind=engine)
 
@@ -45,112 +72,636 @@ def authorize_google_sheets():
     client = gspread.authorize(creds)
     return client
 
-def fetch_user_data(user_id):
-    rows = session.execute(
-        select(user_info_table).where(user_info_table.c.user_id == user_id)
-    ).fetchall()
-    return rows
-
-def get_user_name(user_id):
-    row = session.execute(
-        select(names_table).where(names_table.c.real_user_id == user_id)
-    ).fetchone()
-    if row:
-        # Предполагаем, что real_name в row[1]
-        return row[1]
-    return None
-
-def get_user_rank(user_id):
-    row = session.execute(
-        select(names_table).where(names_table.c.real_user_id == user_id)
-    ).fetchone()
-    if row:
-        # Предполагаем rank в row[5]
-        return row[5]
-    return None
+# Долгоживущий клиент, открытая таблица и индекс листов (title -> Worksheet).
+# gspread ходит в API через google-auth AuthorizedSession, которая сама обновляет
+# истёкший токен, поэтому клиент авторизуется один раз на процесс.
+_sheets_lock = threading.RLock()
+_client = None
+_spreadsheet = None
+_worksheets = None
+
+def get_client():
+    global _client
+    with _sheets_lock:
+        if _client is None:
+            _client = authorize_google_sheets()
+        return _client
+
+def get_spreadsheet():
+    global _spreadsheet
+    with _sheets_lock:
+        if _spreadsheet is not None:
+            return _spreadsheet
+    # Открываем без блокировки: ожидание маркера ограничителя не должно держать
+    # остальные потоки, которым нужен уже закэшированный лист
+    spreadsheet = execute_with_retry(
+        lambda: get_client().open(GOOGLE_SHEET), kind='read', op='open'
+    )
+    with _sheets_lock:
+        if _spreadsheet is None:
+            _spreadsheet = spreadsheet
+        return _spreadsheet
+
+def refresh_worksheet_index():
+    """Перестроить индекс листов одним запросом метаданных. Вызывается в начале каждого экспорта."""
+    global _worksheets
+    spreadsheet = get_spreadsheet()
+    worksheets = execute_with_retry(lambda: spreadsheet.worksheets(), kind='read', op='worksheets')
+    with _sheets_lock:
+        _worksheets = {ws.title: ws for ws in worksheets}
+    return _worksheets
+
+def get_worksheet(title):
+    """Лист из индекса, без отдельного запроса метаданных."""
+    with _sheets_lock:
+        index = _worksheets
+    if index is None:
+        index = refresh_worksheet_index()
+    worksheet = index.get(title)
+    if worksheet is None:
+        raise gspread.exceptions.WorksheetNotFound(title)
+    return worksheet
+
+def add_worksheet(title, rows, cols):
+    """Создать лист и сразу добавить его в индекс."""
+    worksheet = execute_with_retry(
+        lambda: get_spreadsheet().add_worksheet(title=title, rows=rows, cols=cols),
+        op='add_worksheet', sheet=title
+    )
+    with _sheets_lock:
+        if _worksheets is not None:
+            _worksheets[title] = worksheet
+    return worksheet
+
+def use_sheets_backend(client):
+    """
+    Подменить клиент Google Sheets (например, FakeSheetsClient из app.sheets_backend)
+    и сбросить кэш таблицы и листов. reset_sheets_cache() вернёт настоящий клиент.
+    """
+    global _client, _spreadsheet, _worksheets
+    with _sheets_lock:
+        _client = client
+        _spreadsheet = None
+        _worksheets = None
+
+def reset_sheets_cache():
+    """Сбросить клиента, таблицу и индекс (например, после смены учётных данных или таблицы)."""
+    global _client, _spreadsheet, _worksheets
+    with _sheets_lock:
+        _client = None
+        _spreadsheet = None
+        _worksheets = None
+
+# Колонки строки выгрузки: all_data/validator_data = [real_name, month_ru, date, start, end, leads, photo]
+EXPORT_COLUMNS = ['real_name', 'month', 'date', 'start', 'end', 'leads', 'photo']
+
+# Русские названия месяцев по номеру (индекс 0 не используется)
+MONTH_NAMES_RU = np.array([''] + [
+    MONTHS_EN_TO_RU.get(name, name)
+    for name in pd.date_range('2000-01-01', periods=12, freq='MS').month_name()
+], dtype=object)
+# 'ЧЧ:ММ' по номеру минуты в сутках
+TIME_LABELS = np.array([f"{m // 60:02d}:{m % 60:02d}" for m in range(24 * 60)], dtype=object)
+
+# Сколько строк выборки для экспорта читать и форматировать за раз
+EXTRACT_CHUNK_ROWS = 20000
+
+def iter_export_frames(chunksize=EXTRACT_CHUNK_ROWS):
+    """
+    Одна выборка user_info ⋈ names для экспорта, потоково — DataFrame по chunksize строк.
+
+    Строки идут в порядке user_info.id: записи каждого пользователя — в порядке
+    появления, а пользователи — в порядке их первой записи.
+    """
+    query = (
+        select(
+            names_table.c.real_name,
+            names_table.c.rank,
+            user_info_table.c.date,
+            user_info_table.c.start_time,
+            user_info_table.c.end_time,
+            user_info_table.c.leads,
+            user_info_table.c.has_photo
+        )
+        .select_from(user_info_table.join(
+            names_table, names_table.c.real_user_id == user_info_table.c.user_id
+        ))
+        .order_by(user_info_table.c.id)
+        .execution_options(yield_per=chunksize)
+    )
+    with engine.connect() as conn:
+        yield from pd.read_sql(query, conn, chunksize=chunksize)
+
+def load_export_frame():
+    """Вся выборка iter_export_frames() одним DataFrame (для проверок и бенчмарков)."""
+    return pd.concat(list(iter_export_frames()), ignore_index=True)
+
+def _format_days(days):
+    """'dd/mm/YYYY' — strftime только по уникальным дням (их в выгрузке мало)."""
+    codes, uniques = pd.factorize(days)
+    if len(uniques) == 0:
+        return np.full(len(days), '', dtype=object)
+    formatted = np.asarray(uniques.strftime('%d/%m/%Y'), dtype=object)
+    return np.where(codes >= 0, formatted[codes], '')
+
+def _format_times(times):
+    """'ЧЧ:ММ' через таблицу TIME_LABELS, пустая строка для NaT."""
+    missing = times.isna().to_numpy()
+    minutes = (times.dt.hour * 60 + times.dt.minute).fillna(0).astype(int).to_numpy()
+    return np.where(missing, '', TIME_LABELS[minutes])
+
+def format_export_frame(df):
+    """
+    Отформатировать выборку для листов векторно.
+
+    Колонки date, start_time, end_time, leads, has_photo превращаются в
+    month, date, start, end, leads, year, photo; real_name и rank (если есть) сохраняются.
+    """
+    dates = pd.to_datetime(df['date'])
+
+    out = df[[c for c in ('real_name', 'rank') if c in df.columns]].copy()
+    out['month'] = MONTH_NAMES_RU[dates.dt.month.to_numpy()]
+    out['date'] = _format_days(dates.dt.normalize())
+    out['start'] = _format_times(pd.to_datetime(df['start_time']))
+    out['end'] = _format_times(pd.to_datetime(df['end_time']))
+    out['leads'] = df['leads'].fillna(0).astype(int)
+    out['year'] = dates.dt.year.astype(str)
+    out['photo'] = np.where(df['has_photo'] == 1, '+', '-')
+    return out
+
+def frame_rows(df, columns):
+    """Строки DataFrame списками питоновских значений (без numpy-типов, чтобы их можно было сериализовать в JSON)."""
+    return [list(row) for row in zip(*(df[c].tolist() for c in columns))]
 
 def format_data_for_sheet(user_data):
-    formatted = []
-    for record in user_data:
-        # user_info: (id, user_id, date, start_time, end_time, leads, has_photo, started)
-        date_obj = record[2]
-        start_time = record[3]
-        end_time = record[4]
-        leads = record[5]
-        has_photo = record[6]
-
-        date_str = date_obj.strftime('%d/%m/%Y')
-        month_str_en = date_obj.strftime('%B')
-        month_str_ru = MONTHS_EN_TO_RU.get(month_str_en, month_str_en)
-
-        start_str = start_time.strftime('%H:%M') if start_time else ''
-        end_str = end_time.strftime('%H:%M') if end_time else ''
-        photo_str = '+' if has_photo == 1 else '-'
-
-        formatted.append([
-            month_str_ru,
-            date_str,
-            start_str,
-            end_str,
-            leads,
-            photo_str
-        ])
-    return formatted
+    # user_info: (id, user_id, date, start_time, end_time, leads, has_photo, started)
+    frame = pd.DataFrame(
+        [record[2:7] for record in user_data],
+        columns=['date', 'start_time', 'end_time', 'leads', 'has_photo']
+    )
+    return frame_rows(format_export_frame(frame), ['month', 'date', 'start', 'end', 'leads', 'photo'])
+
+def summarize_export_frame(df):
+    """
+    Разложить отформатированную выборку по листам: все строки, менеджеры (rank=1)
+    с их месяцами и годами, валидаторы (rank=2). РОП (rank=3) не отображаем.
+
+    Returns:
+        tuple: (all_data, manager_names, manager_months, manager_years, validator_data).
+    """
+    df = df[df['real_name'].notna() & (df['real_name'] != '') & df['rank'].notna()]
+    all_data = frame_rows(df, EXPORT_COLUMNS)
+
+    managers = df[df['rank'] == 1]
+    manager_names = managers['real_name'].unique().tolist()
+
+    months = managers[['real_name', 'month']].drop_duplicates()
+    months = months.assign(order=months['month'].map(MONTHS_RU_ORDER).fillna(0))
+    manager_months = (months.sort_values('order', kind='stable')
+                      .groupby('real_name', sort=False)['month'].agg(list).to_dict())
+
+    years = managers[['real_name', 'year']].drop_duplicates().sort_values('year', kind='stable')
+    manager_years = years.groupby('real_name', sort=False)['year'].agg(list).to_dict()
+
+    validator_data = frame_rows(df[df['rank'] == 2], EXPORT_COLUMNS)
+    return all_data, manager_names, manager_months, manager_years, validator_data
+
+def collect_export_data():
+    """
+    Собрать данные для всех листов из одной выборки (iter_export_frames).
+
+    Выборка читается и форматируется порциями: сырые даты и время в памяти
+    только для текущей порции, целиком держится уже отформатированная таблица.
+
+    Returns:
+        tuple: (all_data, manager_names, manager_months, manager_years, validator_data),
+               где строки all_data/validator_data = [real_name, month_ru, date, start, end, leads, photo].
+    """
+    frames = [format_export_frame(chunk) for chunk in iter_export_frames()]
+    if not frames:
+        frames = [format_export_frame(pd.DataFrame(
+            columns=['real_name', 'rank', 'date', 'start_time', 'end_time', 'leads', 'has_photo']
+        ))]
+    return summarize_export_frame(pd.concat(frames, ignore_index=True))
+
+def execute_with_retry(func, kind='write', retries=SHEETS_MAX_RETRIES, op=None, sheet=None, payload=None):
+    """
+    Выполнить запрос к Google Sheets через общий ограничитель sheets_limiter.
+
+    kind — 'read' или 'write' (квоты у них раздельные). При 429 все запросы
+    процесса приостанавливаются на Retry-After или откат с джиттером; при
+    временной ошибке сервера (SHEETS_RETRY_STATUSES) с откатом повторяется только
+    этот запрос, и откат входит в ожидание вызова так же, как пауза после 429.
+    op, sheet и payload попадают в учёт вызовов sheets_metrics (операция, лист,
+    ячейки и байты), вместе со временем, ожиданием квоты, повторами и 429.
+    """
+    latency = wait = 0.0
+    throttled = 0
+    attempts = 0
+    last_status = None
+    cells, size = payload_size(payload)
+
+    def record(error=None):
+        # Повторы — все попытки после первой, 429 — те из них, что упёрлись в квоту
+        sheets_metrics.record(op or getattr(func, '__name__', 'call'), sheet, cells, size,
+                              latency, wait, retries=attempts - 1, throttled=throttled, error=error)
 
-def execute_with_retry(func, retries=5, initial_delay=60, delay_on_quota=True):
-    import gspread
-    import time
     for attempt in range(retries):
+        attempts = attempt + 1
+        started = time.monotonic()
+        sheets_limiter.acquire(kind)
+        called = time.monotonic()
+        wait += called - started
         try:
-            func()
-            break
+            result = func()
         except gspread.exceptions.APIError as e:
+            latency += time.monotonic() - called
             status = e.response.status_code
+            last_status = status
             if status == 429:
-                print(f"Quota exceeded. Waiting for {initial_delay} seconds before retrying...")
-                time.sleep(initial_delay)
-                if delay_on_quota:
-                    initial_delay *= 2
+                throttled += 1
+                delay = sheets_limiter.backoff_delay(attempt, sheets_limiter.parse_retry_after(e.response))
+                print(f"Quota exceeded. Waiting for {delay:.1f} seconds before retrying...")
+                sheets_limiter.pause(delay)
+            elif status in SHEETS_RETRY_STATUSES:
+                delay = sheets_limiter.backoff_delay(attempt)
+                print(f"Server error {status}. Waiting for {delay:.1f} seconds before retrying...")
+                time.sleep(delay)
+                wait += delay
             else:
                 print(f"An API error occurred: {e}")
+                record(error=str(status))
                 raise
         except Exception as e:
+            latency += time.monotonic() - called
             print(f"An unexpected error occurred: {e}")
+            record(error=type(e).__name__)
             raise
-    else:
-        print("Max retries exceeded.")
-        raise Exception("Failed to execute function after retries.")
+        else:
+            latency += time.monotonic() - called
+            record()
+            return result
+    print("Max retries exceeded.")
+    record(error=str(last_status))
+    raise Exception("Failed to execute function after retries.")
+
+class SheetBatch:
+    """
+    Накопитель изменений для одного или нескольких листов.
 
-def update_hidden_data_sheet(all_data):
-    client = authorize_google_sheets()
-    spreadsheet = client.open(GOOGLE_SHEET)
-    try:
-        data_sheet = spreadsheet.worksheet('Data')
-    except gspread.exceptions.WorksheetNotFound:
-        data_sheet = spreadsheet.add_worksheet(title='Data', rows="1000", cols="10")
-        data_sheet.hide()
+    Структурные запросы (очистка, валидация, форматирование, заморозка) уходят
+    одним spreadsheets.batchUpdate, значения и формулы — одним values.batchUpdate.
+    """
 
-    headers = ['UserName', 'Month', 'Date', 'Start Time', 'End Time', 'Leads', 'Year', 'Photo']
-    execute_with_retry(lambda: data_sheet.clear())
+    def __init__(self):
+        self.requests = []
+        self.data = []
 
-    data_for_sheet = [headers]
-    for row in all_data:
-        # row = [real_name, month_ru, date_str, start_time, end_time, leads, photo]
-        real_name = row[0]
-        month_str_ru = row[1]
-        date_str = row[2]
-        st_time = row[3]
-        e_time = row[4]
-        leads = row[5]
-        photo = row[6]
+    def add_requests(self, requests):
+        self.requests.extend(requests)
+
+    def extend(self, other):
+        self.requests.extend(other.requests)
+        self.data.extend(other.data)
+
+    def fingerprint(self):
+        """Хеш всего накопленного: одинаковый шаблон листа даёт одинаковый хеш."""
+        payload = json.dumps([self.requests, self.data], ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def clear(self, worksheet):
+        """Очистить значения листа (форматирование остаётся, как у worksheet.clear())."""
+        self.requests.append({
+            'updateCells': {
+                'range': {'sheetId': worksheet._properties['sheetId']},
+                'fields': 'userEnteredValue'
+            }
+        })
+
+    def set_values(self, worksheet, a1, values):
+        """Записать значения как текст (апостроф не даёт Sheets превратить '2024' в число)."""
+        escaped = [[f"'{v}" if isinstance(v, str) else v for v in row] for row in values]
+        self.data.append({'range': absolute_range_name(worksheet.title, a1), 'values': escaped})
+
+    def set_formulas(self, worksheet, a1, values):
+        self.data.append({'range': absolute_range_name(worksheet.title, a1), 'values': values})
+
+    def freeze(self, worksheet, rows=None, cols=None):
+        grid, fields = {}, []
+        if rows is not None:
+            grid['frozenRowCount'] = rows
+            fields.append('gridProperties.frozenRowCount')
+        if cols is not None:
+            grid['frozenColumnCount'] = cols
+            fields.append('gridProperties.frozenColumnCount')
+        self.requests.append({
+            'updateSheetProperties': {
+                'properties': {'sheetId': worksheet._properties['sheetId'], 'gridProperties': grid},
+                'fields': ','.join(fields)
+            }
+        })
+
+    def flush(self):
+        spreadsheet = get_spreadsheet()
+        requests, data = self.requests, self.data
+        self.requests, self.data = [], []
+        if requests:
+            body = {'requests': requests}
+            execute_with_retry(lambda: spreadsheet.batch_update(body), op='batch_update', payload=body)
+        if data:
+            body = {'valueInputOption': 'USER_ENTERED', 'data': data}
+            execute_with_retry(lambda: spreadsheet.values_batch_update(body), op='values_batch_update', payload=body)
+
+def load_sheet_fingerprints():
+    """{название листа: хеш шаблона}, отправленного в прошлый раз."""
+    with Session() as session:
+        rows = session.execute(
+            select(SheetTemplateFingerprint.title, SheetTemplateFingerprint.fingerprint)
+        ).all()
+    return dict(rows)
+
+def save_sheet_fingerprints(fingerprints):
+    if not fingerprints:
+        return
+    stmt = sqlite_insert(SheetTemplateFingerprint).values([
+        {'title': title, 'fingerprint': fp, 'updated_at': datetime.now()}
+        for title, fp in fingerprints.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['title'],
+        set_={'fingerprint': stmt.excluded.fingerprint, 'updated_at': stmt.excluded.updated_at}
+    )
+    with Session() as session:
+        session.execute(stmt)
+        session.commit()
+
+def reset_sheet_fingerprints():
+    """Забыть все хеши — следующая выгрузка пересоберёт все листы."""
+    with Session() as session:
+        session.execute(delete(SheetTemplateFingerprint))
+        session.commit()
+
+def load_staff_sheets():
+    """
+    Менеджеры и валидаторы, у которых уже есть листы, — для стадии форматирования
+    без выгрузки user_info: имена из names, наличие листа — по индексу листов.
+
+    Returns:
+        tuple: (manager_names, has_validators_sheet).
+    """
+    with Session() as session:
+        managers = session.execute(
+            select(names_table.c.real_name).where(names_table.c.rank == 1).order_by(names_table.c.id)
+        ).scalars().all()
+    index = refresh_worksheet_index() if _worksheets is None else _worksheets
+    return [name for name in managers if name in index], 'Валидаторы' in index
+
+def update_template_sheets(stages, extract=None, mode=None, force=False):
+    """
+    Пересобрать «Основную страницу», «Валидаторы» и листы менеджеров.
+
+    stages — какие из стадий 'main', 'validators', 'managers', 'formatting' выполнять;
+    для содержимого нужен extract (результат collect_export_data()), форматирование
+    обходится без него. Содержимое и форматирование каждого листа хешируются отдельно;
+    части с совпадающим хешем пропускаются. force=True пересобирает всё. Листы
+    собираются и отправляются пакетами по SHEETS_BATCH_SHEETS на пуле sheets_pool.
+    mode (по умолчанию EXPORT_MODE) = 'materialized' пишет готовые значения вместо
+    формул по Data; тогда хеш содержимого меняется вместе с данными листа.
+
+    Returns:
+        list: Пересобранные части (название листа, для форматирования — с суффиксом ':formatting').
+    """
+    builders = []
+    if extract is not None:
+        all_data, manager_names, manager_months, manager_years, validator_data = extract
+        has_validators = True
+    else:
+        manager_names, has_validators = load_staff_sheets()
+
+    if stages & {'main', 'validators', 'managers'}:
+        all_months = set()
+        all_years = set()
+        for mm in manager_months.values():
+            all_months.update(mm)
+        for yv in manager_years.values():
+            all_years.update(yv)
+
+        materialized = (mode or EXPORT_MODE) == 'materialized'
+        manager_rows = None
+        if materialized:
+            manager_rows = {name: [] for name in manager_names}
+            for row in all_data:
+                if row[0] in manager_rows:
+                    manager_rows[row[0]].append(row)
+            all_manager_rows = [row for rows in manager_rows.values() for row in rows]
+
+        if 'main' in stages:
+            builders.append(('Основная страница', lambda b: update_main_sheet(
+                manager_names, all_months, all_years, b,
+                rows=all_manager_rows if materialized else None, formatting=False
+            )))
+        if 'validators' in stages:
+            builders.append(('Валидаторы', lambda b: update_validators_sheet(
+                validator_data, b, materialized=materialized, formatting=False
+            )))
+        if 'managers' in stages:
+            for real_name in manager_names:
+                builders.append((real_name, lambda b, name=real_name: update_manager_sheet(
+                    name, manager_months.get(name, []), manager_years.get(name, []), b,
+                    rows=manager_rows[name] if materialized else None, formatting=False
+                )))
+
+    if 'formatting' in stages:
+        # Листы, созданные стадиями выше, уже в индексе: форматирование собирается после них
+        def format_sheet(title, apply):
+            def build(b):
+                try:
+                    apply(get_worksheet(title), b)
+                except gspread.exceptions.WorksheetNotFound:
+                    pass
+            return (f"{title}:formatting", build)
+
+        builders.append(format_sheet('Основная страница', lambda ws, b: apply_main_sheet_formatting(
+            ws, len(manager_names) + 2, b
+        )))
+        if has_validators:
+            builders.append(format_sheet('Валидаторы', apply_formatting))
+        for real_name in manager_names:
+            builders.append(format_sheet(real_name, apply_formatting))
+
+    stored = {} if force else load_sheet_fingerprints()
+
+    def build_part(item):
+        key, build = item
+        sheet_batch = SheetBatch()
+        build(sheet_batch)
+        if not sheet_batch.requests and not sheet_batch.data:
+            return None
+        fp = sheet_batch.fingerprint()
+        if stored.get(key) == fp:
+            return None
+        return key, fp, sheet_batch
+
+    # Недостающие листы создаются при сборке, поэтому она тоже идёт параллельно;
+    # форматирование собирается после содержимого, когда новые листы уже в индексе
+    content = [item for item in builders if not item[0].endswith(':formatting')]
+    formatting = [item for item in builders if item[0].endswith(':formatting')]
+    parts = [part for group in (content, formatting) for part in sheets_pool.map(build_part, group) if part]
+
+    if not parts:
+        print("Шаблоны листов не изменились, пересборка не нужна.")
+        return []
+
+    # Содержимое и форматирование одного листа — в одном пакете, в исходном порядке
+    sheets = {}
+    for part in parts:
+        sheets.setdefault(part[0].removesuffix(':formatting'), []).append(part)
+    groups = list(sheets.values())
+    chunks = [groups[i:i + SHEETS_BATCH_SHEETS] for i in range(0, len(groups), SHEETS_BATCH_SHEETS)]
+
+    def flush_chunk(chunk):
+        # Пакет — один spreadsheets.batchUpdate и один values.batchUpdate
+        batch = SheetBatch()
+        for group in chunk:
+            for _, _, sheet_batch in group:
+                batch.extend(sheet_batch)
+        batch.flush()
+        return {key: fp for group in chunk for key, fp, _ in group}
+
+    futures = [sheets_pool.submit(flush_chunk, chunk) for chunk in chunks]
+    changed, errors = {}, []
+    for future in futures:
+        try:
+            changed.update(future.result())
+        except Exception as e:
+            errors.append(e)
+    # Хеши сохраняются только для отправленных пакетов: остальные листы пересоберутся в следующий раз
+    save_sheet_fingerprints(changed)
+    if errors:
+        raise errors[0]
+    print(f"Пересобраны листы: {', '.join(changed)}")
+    return list(changed)
+
+DATA_HEADERS = ['UserName', 'Month', 'Date', 'Start Time', 'End Time', 'Leads', 'Year', 'Photo']
+DATA_LAST_COL = 'H'
+
+def build_data_rows(all_data):
+    # row = [real_name, month_ru, date_str (dd/mm/YYYY), start_time, end_time, leads, photo];
+    # год — последние четыре символа даты, без повторного разбора
+    return [row[:6] + [row[2][-4:], row[6]] for row in all_data]
+
+def load_data_snapshot():
+    """Строки, отправленные на лист Data в прошлый раз (по порядку), или [] если снимка нет."""
+    with Session() as session:
+        rows = session.execute(
+            select(DataSheetSnapshot.row_json).order_by(DataSheetSnapshot.position)
+        ).scalars().all()
+    return [json.loads(r) for r in rows]
+
+def save_data_snapshot(data_rows, changed_positions=None, start=0):
+    """
+    Сохранить снимок листа Data.
+
+    Без changed_positions снимок перезаписывается целиком; иначе обновляются
+    только изменённые строки и дописываются строки начиная с позиции start.
+    """
+    def to_record(position, row):
+        return {'position': position, 'user_name': row[0], 'date': row[2], 'row_json': json.dumps(row, ensure_ascii=False)}
+
+    with Session() as session:
+        if changed_positions is None:
+            session.execute(delete(DataSheetSnapshot))
+            start = 0
+        else:
+            for position in changed_positions:
+                session.execute(
+                    update(DataSheetSnapshot)
+                    .where(DataSheetSnapshot.position == position)
+                    .values(row_json=json.dumps(data_rows[position], ensure_ascii=False))
+                )
+        appended = [to_record(pos, data_rows[pos]) for pos in range(start, len(data_rows))]
+        if appended:
+            session.execute(insert(DataSheetSnapshot), appended)
+        session.commit()
+
+def diff_data_rows(old_rows, new_rows):
+    """
+    Сравнить новое содержимое листа Data со снимком.
 
-        date_obj = datetime.strptime(date_str, '%d/%m/%Y')
-        year = date_obj.year
-        data_for_sheet.append([real_name, month_str_ru, date_str, st_time, e_time, leads, str(year), photo])
+    Строки сопоставляются по позиции и ключу (пользователь, дата). Выгрузка идёт
+    в порядке user_info.id, поэтому новые записи обычно только дописываются в конец.
 
-    execute_with_retry(lambda: data_sheet.update(data_for_sheet))
+    Returns:
+        tuple: (changed_positions, appended_start) или None, если нужна полная перезапись
+               (снимка нет, строк стало меньше или порядок ключей не совпадает).
+    """
+    if not old_rows or len(new_rows) < len(old_rows):
+        return None
+    changed = []
+    for position, (old, new) in enumerate(zip(old_rows, new_rows)):
+        if (old[0], old[2]) != (new[0], new[2]):
+            return None
+        if old != new:
+            changed.append(position)
+    return changed, len(old_rows)
+
+def _contiguous_ranges(positions):
+    """[1, 2, 3, 7] -> [(1, 3), (7, 7)]"""
+    ranges = []
+    for pos in positions:
+        if ranges and ranges[-1][1] == pos - 1:
+            ranges[-1] = (ranges[-1][0], pos)
+        else:
+            ranges.append((pos, pos))
+    return ranges
 
-def apply_formatting(worksheet):
+def update_hidden_data_sheet(all_data):
+    created = False
+    try:
+        data_sheet = get_worksheet('Data')
+    except gspread.exceptions.WorksheetNotFound:
+        data_sheet = add_worksheet('Data', rows="1000", cols="10")
+        execute_with_retry(lambda: data_sheet.hide(), op='hide', sheet='Data')
+        created = True
+
+    data_rows = build_data_rows(all_data)
+    diff = None if created else diff_data_rows(load_data_snapshot(), data_rows)
+
+    if diff is None:
+        # Полная перезапись листа
+        print(f"Data: полная перезапись, {len(data_rows)} строк.")
+        values = [DATA_HEADERS] + data_rows
+        execute_with_retry(lambda: data_sheet.clear(), op='clear', sheet='Data')
+        execute_with_retry(lambda: data_sheet.update(values), op='update', sheet='Data', payload=values)
+        save_data_snapshot(data_rows)
+        return
+
+    changed, appended_start = diff
+    if not changed and appended_start == len(data_rows):
+        print("Data: изменений нет.")
+        return
+
+    # Строка листа = позиция + 2 (первая строка — заголовки)
+    ranges = []
+    for first, last in _contiguous_ranges(changed):
+        ranges.append({
+            'range': f"A{first + 2}:{DATA_LAST_COL}{last + 2}",
+            'values': data_rows[first:last + 1]
+        })
+    if appended_start < len(data_rows):
+        ranges.append({
+            'range': f"A{appended_start + 2}:{DATA_LAST_COL}{len(data_rows) + 1}",
+            'values': data_rows[appended_start:]
+        })
+        missing_rows = len(data_rows) + 1 - data_sheet.row_count
+        if missing_rows > 0:
+            execute_with_retry(lambda: data_sheet.add_rows(missing_rows), op='add_rows', sheet='Data')
+
+    print(f"Data: изменено {len(changed)} строк, добавлено {len(data_rows) - appended_start}.")
+    execute_with_retry(lambda: data_sheet.batch_update(ranges), op='ws_batch_update', sheet='Data', payload=ranges)
+    save_data_snapshot(data_rows, changed_positions=changed, start=appended_start)
+
+def apply_formatting(worksheet, batch=None):
     sheet_id = worksheet._properties['sheetId']
     last_col_index = 26
 
@@ -184,90 +735,186 @@ def apply_formatting(worksheet):
             }
         }
     ]
-    client = authorize_google_sheets()
-    execute_with_retry(lambda: worksheet.spreadsheet.batch_update({'requests': requests}))
-    worksheet.freeze(rows=2, cols=1)
-
-def update_manager_sheet(manager_name, months, years):
-    client = authorize_google_sheets()
-    spreadsheet = client.open(GOOGLE_SHEET)
-    try:
-        manager_sheet = spreadsheet.worksheet(manager_name)
-    except gspread.exceptions.WorksheetNotFound:
-        print(f"Worksheet '{manager_name}' not found. Creating new one.")
-        def add_worksheet():
-            spreadsheet.add_worksheet(title=manager_name, rows="1000", cols="26")
-        execute_with_retry(add_worksheet, retries=5, initial_delay=60)
-        manager_sheet = spreadsheet.worksheet(manager_name)
-
-    execute_with_retry(lambda: manager_sheet.clear())
-    execute_with_retry(lambda: manager_sheet.update('A1', [[manager_name]]))
-
-    current_datetime = datetime.now()
-    current_month_en = current_datetime.strftime('%B')
-    current_year = str(current_datetime.year)
-    current_month_ru = MONTHS_EN_TO_RU.get(current_month_en, current_month_en)
-    months_lower = [m.lower() for m in months]
-
-    if current_month_ru.lower() in months_lower:
-        default_month = current_month_ru.capitalize()
-    else:
-        default_month = months[-1].capitalize() if months else ''
-
-    if current_year in years:
-        default_year = current_year
-    else:
-        default_year = years[-1] if years else ''
-
-    execute_with_retry(lambda: manager_sheet.update('B2', [[default_month]]))
-    execute_with_retry(lambda: manager_sheet.update('D2', [[default_year]]))
+    own_batch = batch is None
+    batch = batch or SheetBatch()
+    batch.add_requests(requests)
+    batch.freeze(worksheet, rows=2, cols=1)
+    if own_batch:
+        batch.flush()
+
+def aggregate_month_blocks(rows):
+    """
+    Свести записи в блоки по месяцам для материализованного режима.
 
-    sheet_id = manager_sheet._properties['sheetId']
-    months_capitalized = [m.capitalize() for m in months]
-    requests = [
+    Returns:
+        dict: {(year, month_lower): {date_str: {'intervals', 'leads', 'photo'}}},
+              месяцы и даты — в порядке появления в выгрузке (как UNIQUE(FILTER(...))).
+    """
+    blocks = {}
+    for real_name, month_ru, date_str, start, end, leads, photo in rows:
+        days = blocks.setdefault((date_str[-4:], month_ru.strip().lower()), {})
+        day = days.setdefault(date_str, {'intervals': [], 'leads': 0, 'photo': False})
+        day['intervals'].append(f"{start or 'н/д'}-{end or 'н/д'}")
+        day['leads'] += leads or 0
+        day['photo'] = day['photo'] or photo == '+'
+    return blocks
+
+def block_lookup_formula(key_expr, last_col, default):
+    """Строка скрытого блока по ключу в колонке A: INDEX(..., MATCH(...), 0) разливается вправо."""
+    row = MATERIALIZED_BLOCK_ROW
+    return (f'=IFERROR(INDEX($B${row}:${last_col}, MATCH({key_expr}, $A${row}:$A, 0), 0), '
+            f'{default})')
+
+def set_hidden_block_rows(batch, worksheet, block_rows, num_cols):
+    """Записать скрытые строки блоков начиная с MATERIALIZED_BLOCK_ROW, при нужде расширив сетку."""
+    sheet_id = worksheet._properties['sheetId']
+    last_row = MATERIALIZED_BLOCK_ROW + len(block_rows)
+    batch.add_requests([
         {
-            'setDataValidation': {
+            'updateSheetProperties': {
+                'properties': {'sheetId': sheet_id, 'gridProperties': {
+                    'rowCount': max(worksheet.row_count, last_row),
+                    'columnCount': max(worksheet.col_count, num_cols)
+                }},
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount'
+            }
+        },
+        {
+            'updateDimensionProperties': {
                 'range': {
                     'sheetId': sheet_id,
-                    'startRowIndex': 1,
-                    'endRowIndex': 2,
-                    'startColumnIndex': 1,
-                    'endColumnIndex': 2
+                    'dimension': 'ROWS',
+                    'startIndex': MATERIALIZED_BLOCK_ROW - 1,
+                    'endIndex': last_row
                 },
-                'rule': {
-                    'condition': {
-                        'type': 'ONE_OF_LIST',
-                        'values': [{'userEnteredValue': m} for m in months_capitalized]
-                    },
-                    'showCustomUi': True
-                }
+                'properties': {'hiddenByUser': True},
+                'fields': 'hiddenByUser'
+            }
+        }
+    ])
+    if block_rows:
+        batch.set_values(worksheet, f'A{MATERIALIZED_BLOCK_ROW}', block_rows)
+
+def set_manager_month_blocks(batch, manager_sheet, rows):
+    """
+    Материализованный режим листа менеджера: по четыре скрытые строки на месяц
+    (даты, время работы, лиды, итого), видимые строки 3–6 выбирают блок по B2/D2.
+    """
+    block_rows = []
+    max_days = 1
+    for (year, month), days in aggregate_month_blocks(rows).items():
+        key = f"{year}|{month}"
+        works = []
+        for day in days.values():
+            work = '\n'.join(day['intervals'])
+            works.append('н/д за день' if work == 'н/д-н/д' else work)
+        block_rows.append([f"{key}|date"] + list(days))
+        block_rows.append([f"{key}|work"] + works)
+        block_rows.append([f"{key}|leads"] + [day['leads'] for day in days.values()])
+        block_rows.append([f"{key}|total", sum(day['leads'] for day in days.values())])
+        max_days = max(max_days, len(days))
+
+    num_cols = max_days + 1
+    last_col = rowcol_to_a1(1, num_cols).rstrip('1')
+    set_hidden_block_rows(batch, manager_sheet, block_rows, num_cols)
+
+    key_expr = 'TRIM($D$2)&"|"&LOWER(TRIM($B$2))&"|{}"'
+    batch.set_formulas(manager_sheet, 'B3:B6', [
+        [block_lookup_formula(key_expr.format('date'), last_col, '"Нет данных"')],
+        [block_lookup_formula(key_expr.format('work'), last_col, '""')],
+        [block_lookup_formula(key_expr.format('leads'), last_col, '""')],
+        [block_lookup_formula(key_expr.format('total'), 'B', '0')],
+    ])
+
+def set_validator_month_blocks(batch, val_sheet, validators_data):
+    """
+    Материализованный режим листа «Валидаторы»: по три скрытые строки
+    на валидатора и месяц (даты, время работы, отчёт), выбор — по A2/B2/D2.
+    """
+    by_name = {}
+    for row in validators_data:
+        by_name.setdefault(row[0], []).append(row)
+
+    block_rows = []
+    max_days = 1
+    for name in sorted(by_name):
+        for (year, month), days in aggregate_month_blocks(by_name[name]).items():
+            key = f"{name}|{year}|{month}"
+            block_rows.append([f"{key}|date"] + list(days))
+            block_rows.append([f"{key}|work"] + ['\n'.join(day['intervals']) for day in days.values()])
+            block_rows.append([f"{key}|report"] + ['+' if day['photo'] else '-' for day in days.values()])
+            max_days = max(max_days, len(days))
+
+    num_cols = max_days + 1
+    last_col = rowcol_to_a1(1, num_cols).rstrip('1')
+    set_hidden_block_rows(batch, val_sheet, block_rows, num_cols)
+
+    key_expr = 'TRIM($A$2)&"|"&TRIM($D$2)&"|"&LOWER(TRIM($B$2))&"|{}"'
+    batch.set_formulas(val_sheet, 'B3:B5', [
+        [block_lookup_formula(key_expr.format('date'), last_col, '"Нет данных"')],
+        [block_lookup_formula(key_expr.format('work'), last_col, '""')],
+        [block_lookup_formula(key_expr.format('report'), last_col, '""')],
+    ])
+
+def set_main_month_blocks(batch, main_sheet, manager_names, rows):
+    """
+    Материализованный режим «Основной страницы»: скрытые колонки с F —
+    лиды менеджера за каждый месяц (ключ «год|месяц» в строке 1); B выбирает
+    колонку по B1/B2, C — готовая сумма за всё время.
+    """
+    monthly = {name: {} for name in manager_names}
+    for real_name, month_ru, date_str, start, end, leads, photo in rows:
+        if real_name not in monthly:
+            continue
+        key = f"{date_str[-4:]}|{month_ru.strip().lower()}"
+        monthly[real_name][key] = monthly[real_name].get(key, 0) + (leads or 0)
+    keys = list(dict.fromkeys(key for totals in monthly.values() for key in totals))
+
+    sheet_id = main_sheet._properties['sheetId']
+    first_col = MATERIALIZED_BLOCK_COL
+    num_cols = first_col + max(len(keys), 1) - 1
+    first = rowcol_to_a1(1, first_col).rstrip('1')
+    last = rowcol_to_a1(1, num_cols).rstrip('1')
+    batch.add_requests([
+        {
+            'updateSheetProperties': {
+                'properties': {'sheetId': sheet_id, 'gridProperties': {
+                    'columnCount': max(main_sheet.col_count, num_cols)
+                }},
+                'fields': 'gridProperties.columnCount'
             }
         },
         {
-            'setDataValidation': {
+            'updateDimensionProperties': {
                 'range': {
                     'sheetId': sheet_id,
-                    'startRowIndex': 1,
-                    'endRowIndex': 2,
-                    'startColumnIndex': 3,
-                    'endColumnIndex': 4
+                    'dimension': 'COLUMNS',
+                    'startIndex': first_col - 1,
+                    'endIndex': num_cols
                 },
-                'rule': {
-                    'condition': {
-                        'type': 'ONE_OF_LIST',
-                        'values': [{'userEnteredValue': str(y)} for y in years]
-                    },
-                    'showCustomUi': True
-                }
+                'properties': {'hiddenByUser': True},
+                'fields': 'hiddenByUser'
             }
         }
-    ]
-    body = {'requests': requests}
-    execute_with_retry(lambda: spreadsheet.batch_update(body))
+    ])
+    if keys:
+        batch.set_values(main_sheet, f'{first}1', [keys])
+        batch.set_values(main_sheet, f'{first}3', [
+            [monthly[name].get(key, 0) for key in keys] for name in manager_names
+        ])
 
-    labels = [['Месяц'], ['Дата'], ['Время работы'], ['Лидов получено'], ['Лидов за месяц итого']]
-    execute_with_retry(lambda: manager_sheet.update('A2:A6', labels))
+    formulas = []
+    for idx, name in enumerate(manager_names):
+        row = idx + 3
+        formulas.append([
+            f'=IFERROR(INDEX(${first}{row}:${last}{row}, '
+            f'MATCH(TRIM(B$2)&"|"&LOWER(TRIM(B$1)), ${first}$1:${last}$1, 0)), 0)',
+            sum(monthly[name].values())
+        ])
+    batch.set_formulas(main_sheet, 'B3', formulas)
 
+def set_manager_formulas(batch, manager_sheet):
+    """Строки 3–6 листа менеджера — формулы по листу Data (режим 'formulas')."""
     date_formula = '''=IFERROR(
   TRANSPOSE(
     UNIQUE(
@@ -280,7 +927,7 @@ def update_manager_sheet(manager_name, months, years):
   ),
   "Нет данных"
 )'''
-    execute_with_retry(lambda: manager_sheet.update('B3', [[date_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(manager_sheet, 'B3', [[date_formula]])
 
     working_time_formula = '''=ARRAYFORMULA(
         IF(
@@ -328,7 +975,7 @@ def update_manager_sheet(manager_name, months, years):
         )
         )
         '''
-    execute_with_retry(lambda: manager_sheet.update('B4', [[working_time_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(manager_sheet, 'B4', [[working_time_formula]])
 
     leads_formula = '''=ARRAYFORMULA(
 IF(
@@ -356,7 +1003,7 @@ Data!F2:F,
 )
 )
 )'''
-    execute_with_retry(lambda: manager_sheet.update('B5', [[leads_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(manager_sheet, 'B5', [[leads_formula]])
 
     total_leads_formula = '''=IFERROR(
 SUM(
@@ -369,138 +1016,104 @@ Data!F2:F,
 ),
 0
 )'''
-    execute_with_retry(lambda: manager_sheet.update('B6', [[total_leads_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(manager_sheet, 'B6', [[total_leads_formula]])
 
-    apply_formatting(manager_sheet)
+def update_manager_sheet(manager_name, months, years, batch=None, rows=None, formatting=True):
+    """
+    Пересобрать лист менеджера. С batch изменения только накапливаются,
+    иначе отправляются сразу (два запроса к API).
 
-def update_validators_sheet(validators_data):
-    sheet_title = 'Валидаторы'
-    client = authorize_google_sheets()
-    spreadsheet = client.open(GOOGLE_SHEET)
+    rows — записи менеджера ([real_name, month_ru, date, start, end, leads, photo]);
+    если переданы, лист заполняется готовыми значениями вместо формул.
+    formatting=False — только содержимое (форматирование — отдельная стадия экспорта).
+    """
+    own_batch = batch is None
+    batch = batch or SheetBatch()
     try:
-        val_sheet = spreadsheet.worksheet(sheet_title)
+        manager_sheet = get_worksheet(manager_name)
     except gspread.exceptions.WorksheetNotFound:
-        print(f"Worksheet '{sheet_title}' not found. Creating new.")
-        def add_worksheet():
-            spreadsheet.add_worksheet(title=sheet_title, rows="1000", cols="26")
-        execute_with_retry(add_worksheet, retries=5, initial_delay=60)
-        val_sheet = spreadsheet.worksheet(sheet_title)
-
-    execute_with_retry(lambda: val_sheet.clear())
-    execute_with_retry(lambda: val_sheet.update('A1', [['Валидаторы']]))
+        print(f"Worksheet '{manager_name}' not found. Creating new one.")
+        manager_sheet = add_worksheet(manager_name, rows="1000", cols="26")
 
-    # Уникальные валидаторы
-    validator_names = sorted(set([row[0] for row in validators_data]))
-    # Собираем все месяцы и годы для валидаторов
-    months_all = []
-    years_all = []
-    for row in validators_data:
-        # row: [real_name, month_ru, date, start, end, leads, photo]
-        months_all.append(row[1].strip())
-        date_str = row[2]
-        y = date_str.split('/')[-1]
-        years_all.append(y)
-    unique_months = sorted(set(months_all), key=lambda m: MONTHS_RU_ORDER.get(m, 0))
-    unique_years = sorted(set(years_all))
+    batch.clear(manager_sheet)
+    batch.set_values(manager_sheet, 'A1', [[manager_name]])
 
-    # Определим значения по умолчанию (месяц и год)
     current_datetime = datetime.now()
     current_month_en = current_datetime.strftime('%B')
     current_year = str(current_datetime.year)
     current_month_ru = MONTHS_EN_TO_RU.get(current_month_en, current_month_en)
+    months_lower = [m.lower() for m in months]
 
-    if current_month_ru in unique_months:
-        default_month = current_month_ru
+    if current_month_ru.lower() in months_lower:
+        default_month = current_month_ru.capitalize()
     else:
-        default_month = unique_months[-1] if unique_months else ''
-    if current_year in unique_years:
+        default_month = months[-1].capitalize() if months else ''
+
+    if current_year in years:
         default_year = current_year
     else:
-        default_year = unique_years[-1] if unique_years else ''
+        default_year = years[-1] if years else ''
 
-    # A2 - выпадающий список валидаторов
-    sheet_id = val_sheet._properties['sheetId']
-    validator_validation = {
-        'setDataValidation': {
-            'range': {
-                'sheetId': sheet_id,
-                'startRowIndex': 1,
-                'endRowIndex': 2,
-                'startColumnIndex': 0,
-                'endColumnIndex': 1
-            },
-            'rule': {
-                'condition': {
-                    'type': 'ONE_OF_LIST',
-                    'values': [{'userEnteredValue': name} for name in validator_names]
-                },
-                'showCustomUi': True
-            }
-        }
-    }
+    batch.set_values(manager_sheet, 'B2', [[default_month]])
+    batch.set_values(manager_sheet, 'D2', [[default_year]])
 
-    # B2 - выпадающий список месяцев
-    month_validation = {
-        'setDataValidation': {
-            'range': {
-                'sheetId': sheet_id,
-                'startRowIndex': 1,
-                'endRowIndex': 2,
-                'startColumnIndex': 1, # B
-                'endColumnIndex': 2
-            },
-            'rule': {
-                'condition': {
-                    'type': 'ONE_OF_LIST',
-                    'values': [{'userEnteredValue': m} for m in unique_months]
+    sheet_id = manager_sheet._properties['sheetId']
+    months_capitalized = [m.capitalize() for m in months]
+    requests = [
+        {
+            'setDataValidation': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': 1,
+                    'endRowIndex': 2,
+                    'startColumnIndex': 1,
+                    'endColumnIndex': 2
                 },
-                'showCustomUi': True
+                'rule': {
+                    'condition': {
+                        'type': 'ONE_OF_LIST',
+                        'values': [{'userEnteredValue': m} for m in months_capitalized]
+                    },
+                    'showCustomUi': True
+                }
             }
-        }
-    }
-
-    # D2 - выпадающий список годов
-    year_validation = {
-        'setDataValidation': {
-            'range': {
-                'sheetId': sheet_id,
-                'startRowIndex': 1,
-                'endRowIndex': 2,
-                'startColumnIndex': 3, # D
-                'endColumnIndex': 4
-            },
-            'rule': {
-                'condition': {
-                    'type': 'ONE_OF_LIST',
-                    'values': [{'userEnteredValue': str(y)} for y in unique_years]
+        },
+        {
+            'setDataValidation': {
+                'range': {
+                    'sheetId': sheet_id,
+                    'startRowIndex': 1,
+                    'endRowIndex': 2,
+                    'startColumnIndex': 3,
+                    'endColumnIndex': 4
                 },
-                'showCustomUi': True
+                'rule': {
+                    'condition': {
+                        'type': 'ONE_OF_LIST',
+                        'values': [{'userEnteredValue': str(y)} for y in years]
+                    },
+                    'showCustomUi': True
+                }
             }
         }
-    }
+    ]
+    batch.add_requests(requests)
 
-    body = {'requests': [validator_validation, month_validation, year_validation]}
-    execute_with_retry(lambda: spreadsheet.batch_update(body))
+    labels = [['Месяц'], ['Дата'], ['Время работы'], ['Лидов получено'], ['Лидов за месяц итого']]
+    batch.set_values(manager_sheet, 'A2:A6', labels)
 
-    # Устанавливаем значения по умолчанию:
-    # Первый валидатор
-    if validator_names:
-        execute_with_retry(lambda: val_sheet.update('A2', [[validator_names[0]]]))
-    # Месяц
-    if default_month:
-        execute_with_retry(lambda: val_sheet.update('B2', [[default_month]]))
-    # Год
-    if default_year:
-        execute_with_retry(lambda: val_sheet.update('D2', [[default_year]]))
+    if rows is None:
+        set_manager_formulas(batch, manager_sheet)
+    else:
+        set_manager_month_blocks(batch, manager_sheet, rows)
 
-    # Подписи:
-    # A3: "Дата"
-    # A4: "Время работы"
-    # A5: "Отчет"
-    execute_with_retry(lambda: val_sheet.update('A3', [['Дата']]))
-    execute_with_retry(lambda: val_sheet.update('A4', [['Время работы']]))
-    execute_with_retry(lambda: val_sheet.update('A5', [['Отчет']]))
+    if formatting:
+        apply_formatting(manager_sheet, batch)
+    if own_batch:
+        batch.flush()
 
+def set_validator_formulas(batch, val_sheet):
+    """Строки 3–5 листа «Валидаторы» — формулы по листу Data (режим 'formulas')."""
     # Формулы по аналогии с менеджерами:
     # Дата (B3): даты, соответствующие валидатору (A2), месяцу (B2), году (D2)
     date_formula = '''=IFERROR(
@@ -515,7 +1128,7 @@ def update_validators_sheet(validators_data):
   ),
   "Нет данных"
 )'''
-    execute_with_retry(lambda: val_sheet.update('B3', [[date_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(val_sheet, 'B3', [[date_formula]])
 
     # Время работы (B4) - по аналогии с менеджерами, только A$2 вместо A$1
     working_time_formula = '''=ARRAYFORMULA(
@@ -556,7 +1169,7 @@ IF(LEN(TRIM(Data!D2:D))=0,"н/д",Data!D2:D)&"-"&IF(LEN(TRIM(Data!E2:E))=0,"н/
 )
 )
 '''
-    execute_with_retry(lambda: val_sheet.update('B4', [[working_time_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(val_sheet, 'B4', [[working_time_formula]])
 
     # Отчет (B5): нужно вывести '+' если хотя бы в одной записи есть '+', иначе '-'
     # Можно использовать MAX() или COUNTIF. Если фото хотя бы раз '+', показать '+'
@@ -592,24 +1205,169 @@ Data!H2:H,
 )
 )
 )'''
-    execute_with_retry(lambda: val_sheet.update('B5', [[report_formula]], value_input_option='USER_ENTERED'))
+    batch.set_formulas(val_sheet, 'B5', [[report_formula]])
+
+def update_validators_sheet(validators_data, batch=None, materialized=False, formatting=True):
+    sheet_title = 'Валидаторы'
+    own_batch = batch is None
+    batch = batch or SheetBatch()
+    try:
+        val_sheet = get_worksheet(sheet_title)
+    except gspread.exceptions.WorksheetNotFound:
+        print(f"Worksheet '{sheet_title}' not found. Creating new.")
+        val_sheet = add_worksheet(sheet_title, rows="1000", cols="26")
+
+    batch.clear(val_sheet)
+    batch.set_values(val_sheet, 'A1', [['Валидаторы']])
+
+    # Уникальные валидаторы
+    validator_names = sorted(set([row[0] for row in validators_data]))
+    # Собираем все месяцы и годы для валидаторов
+    months_all = []
+    years_all = []
+    for row in validators_data:
+        # row: [real_name, month_ru, date, start, end, leads, photo]
+        months_all.append(row[1].strip())
+        date_str = row[2]
+        y = date_str.split('/')[-1]
+        years_all.append(y)
+    unique_months = sorted(set(months_all), key=lambda m: MONTHS_RU_ORDER.get(m, 0))
+    unique_years = sorted(set(years_all))
+
+    # Определим значения по умолчанию (месяц и год)
+    current_datetime = datetime.now()
+    current_month_en = current_datetime.strftime('%B')
+    current_year = str(current_datetime.year)
+    current_month_ru = MONTHS_EN_TO_RU.get(current_month_en, current_month_en)
+
+    if current_month_ru in unique_months:
+        default_month = current_month_ru
+    else:
+        default_month = unique_months[-1] if unique_months else ''
+    if current_year in unique_years:
+        default_year = current_year
+    else:
+        default_year = unique_years[-1] if unique_years else ''
+
+    # A2 - выпадающий список валидаторов
+    sheet_id = val_sheet._properties['sheetId']
+    validator_validation = {
+        'setDataValidation': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 1,
+                'endRowIndex': 2,
+                'startColumnIndex': 0,
+                'endColumnIndex': 1
+            },
+            'rule': {
+                'condition': {
+                    'type': 'ONE_OF_LIST',
+                    'values': [{'userEnteredValue': name} for name in validator_names]
+                },
+                'showCustomUi': True
+            }
+        }
+    }
+
+    # B2 - выпадающий список месяцев
+    month_validation = {
+        'setDataValidation': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 1,
+                'endRowIndex': 2,
+                'startColumnIndex': 1, # B
+                'endColumnIndex': 2
+            },
+            'rule': {
+                'condition': {
+                    'type': 'ONE_OF_LIST',
+                    'values': [{'userEnteredValue': m} for m in unique_months]
+                },
+                'showCustomUi': True
+            }
+        }
+    }
+
+    # D2 - выпадающий список годов
+    year_validation = {
+        'setDataValidation': {
+            'range': {
+                'sheetId': sheet_id,
+                'startRowIndex': 1,
+                'endRowIndex': 2,
+                'startColumnIndex': 3, # D
+                'endColumnIndex': 4
+            },
+            'rule': {
+                'condition': {
+                    'type': 'ONE_OF_LIST',
+                    'values': [{'userEnteredValue': str(y)} for y in unique_years]
+                },
+                'showCustomUi': True
+            }
+        }
+    }
 
-    apply_formatting(val_sheet)
+    batch.add_requests([validator_validation, month_validation, year_validation])
 
-def update_main_sheet(manager_names, all_months, all_years):
-    client = authorize_google_sheets()
-    spreadsheet = client.open(GOOGLE_SHEET)
+    # Устанавливаем значения по умолчанию:
+    # Первый валидатор
+    if validator_names:
+        batch.set_values(val_sheet, 'A2', [[validator_names[0]]])
+    # Месяц
+    if default_month:
+        batch.set_values(val_sheet, 'B2', [[default_month]])
+    # Год
+    if default_year:
+        batch.set_values(val_sheet, 'D2', [[default_year]])
+
+    # Подписи:
+    # A3: "Дата"
+    # A4: "Время работы"
+    # A5: "Отчет"
+    batch.set_values(val_sheet, 'A3', [['Дата']])
+    batch.set_values(val_sheet, 'A4', [['Время работы']])
+    batch.set_values(val_sheet, 'A5', [['Отчет']])
+
+    if materialized:
+        set_validator_month_blocks(batch, val_sheet, validators_data)
+    else:
+        set_validator_formulas(batch, val_sheet)
+
+    if formatting:
+        apply_formatting(val_sheet, batch)
+    if own_batch:
+        batch.flush()
+
+def set_main_formulas(batch, main_sheet, num_managers):
+    """Колонки B и C «Основной страницы» — формулы по листу Data (режим 'formulas')."""
+    formulas_b = []
+    for idx in range(num_managers):
+        row = idx + 3
+        formula = f"=IFERROR(SUM(FILTER(Data!F:F,(Data!A:A=A{row})*(Data!B:B=B$1)*(Data!G:G=B$2))),0)"
+        formulas_b.append([formula])
+    batch.set_formulas(main_sheet, 'B3', formulas_b)
+
+    formulas_c = []
+    for idx in range(num_managers):
+        row = idx + 3
+        formula = f"=IFERROR(SUMIF(Data!A:A, A{row}, Data!F:F),0)"
+        formulas_c.append([formula])
+    batch.set_formulas(main_sheet, 'C3', formulas_c)
+
+def update_main_sheet(manager_names, all_months, all_years, batch=None, rows=None, formatting=True):
+    own_batch = batch is None
+    batch = batch or SheetBatch()
     try:
-        main_sheet = spreadsheet.worksheet('Основная страница')
+        main_sheet = get_worksheet('Основная страница')
     except gspread.exceptions.WorksheetNotFound:
         print("Worksheet 'Основная страница' not found. Creating new.")
-        def add_worksheet():
-            spreadsheet.add_worksheet(title='Основная страница', rows="1000", cols="10")
-        execute_with_retry(add_worksheet, retries=5, initial_delay=60)
-        main_sheet = spreadsheet.worksheet('Основная страница')
+        main_sheet = add_worksheet('Основная страница', rows="1000", cols="10")
 
-    execute_with_retry(lambda: main_sheet.clear())
-    execute_with_retry(lambda: main_sheet.update('A1', [['Общая информация']]))
+    batch.clear(main_sheet)
+    batch.set_values(main_sheet, 'A1', [['Общая информация']])
 
     current_datetime = datetime.now()
     current_month_en = current_datetime.strftime('%B')
@@ -629,8 +1387,8 @@ def update_main_sheet(manager_names, all_months, all_years):
     else:
         default_year = years_list[-1] if years_list else ''
 
-    execute_with_retry(lambda: main_sheet.update('B1', [[default_month]]))
-    execute_with_retry(lambda: main_sheet.update('B2', [[default_year]]))
+    batch.set_values(main_sheet, 'B1', [[default_month]])
+    batch.set_values(main_sheet, 'B2', [[default_year]])
 
     sheet_id = main_sheet._properties['sheetId']
     merge_requests = [
@@ -659,8 +1417,8 @@ def update_main_sheet(manager_names, all_months, all_years):
             }
         }
     ]
-    execute_with_retry(lambda: spreadsheet.batch_update({'requests': merge_requests}))
-    execute_with_retry(lambda: main_sheet.update('C1', [['За всё время']]))
+    batch.add_requests(merge_requests)
+    batch.set_values(main_sheet, 'C1', [['За всё время']])
 
     validation_requests = [
         {
@@ -700,30 +1458,24 @@ def update_main_sheet(manager_names, all_months, all_years):
             }
         }
     ]
-    execute_with_retry(lambda: spreadsheet.batch_update({'requests': validation_requests}))
+    batch.add_requests(validation_requests)
 
     data = [[manager_name] for manager_name in manager_names]
     print(f"Updating range A3 with data: {data}")
-    execute_with_retry(lambda: main_sheet.update('A3', data))
+    batch.set_values(main_sheet, 'A3', data)
 
     num_rows = len(manager_names) + 2
-    formulas_b = []
-    for idx in range(len(manager_names)):
-        row = idx + 3
-        formula = f"=IFERROR(SUM(FILTER(Data!F:F,(Data!A:A=A{row})*(Data!B:B=B$1)*(Data!G:G=B$2))),0)"
-        formulas_b.append([formula])
-    execute_with_retry(lambda: main_sheet.update('B3', formulas_b, value_input_option='USER_ENTERED'))
-
-    formulas_c = []
-    for idx in range(len(manager_names)):
-        row = idx + 3
-        formula = f"=IFERROR(SUMIF(Data!A:A, A{row}, Data!F:F),0)"
-        formulas_c.append([formula])
-    execute_with_retry(lambda: main_sheet.update('C3', formulas_c, value_input_option='USER_ENTERED'))
+    if rows is None:
+        set_main_formulas(batch, main_sheet, len(manager_names))
+    else:
+        set_main_month_blocks(batch, main_sheet, manager_names, rows)
 
-    apply_main_sheet_formatting(main_sheet, num_rows)
+    if formatting:
+        apply_main_sheet_formatting(main_sheet, num_rows, batch)
+    if own_batch:
+        batch.flush()
 
-def apply_main_sheet_formatting(main_sheet, num_rows):
+def apply_main_sheet_formatting(main_sheet, num_rows, batch=None):
     sheet_id = main_sheet._properties['sheetId']
     requests = [
         {
@@ -924,182 +1676,78 @@ def apply_main_sheet_formatting(main_sheet, num_rows):
         }
     })
 
-    client = authorize_google_sheets()
-    execute_with_retry(lambda: main_sheet.spreadsheet.batch_update({'requests': requests}))
-    main_sheet.freeze(rows=2)
+    own_batch = batch is None
+    batch = batch or SheetBatch()
+    batch.add_requests(requests)
+    batch.freeze(main_sheet, rows=2)
+    if own_batch:
+        batch.flush()
+
+# Стадии экспорта в порядке выполнения
+EXPORT_STAGES = ('data', 'main', 'validators', 'managers', 'formatting')
+ALL_STAGES = EXPORT_STAGES
+DATA_STAGES = ('data',)
+FORMATTING_STAGES = ('formatting',)
+CONTENT_STAGES = ('data', 'main', 'validators', 'managers')
+
+def data_change_stages(mode=None):
+    """
+    Стадии, которые нужно выполнить после изменения данных в БД.
 
-async def update_all_data():
-    from sqlalchemy.sql import func
-    user_ids = session.query(user_info_table.c.user_id).distinct().all()
-
-    all_data = []
-    manager_names = []
-    manager_months = {}
-    manager_years = {}
-    validator_data = []
-
-    for (u_id,) in user_ids:
-        real_name = get_user_name(u_id)
-        rank = get_user_rank(u_id)
-        if not real_name or rank is None:
-            continue
-        user_data = fetch_user_data(u_id)
-        formatted = format_data_for_sheet(user_data)
-        for fd in formatted:
-            all_data.append([real_name] + fd)
-
-        if rank == 1:
-            months = [r[0] for r in formatted]
-            unique_months = sorted(set(months), key=lambda m: MONTHS_RU_ORDER.get(m, 0))
-            years_list = [r[1].split('/')[-1] for r in formatted]
-            unique_years = sorted(set(years_list))
-            manager_names.append(real_name)
-            manager_months[real_name] = unique_months
-            manager_years[real_name] = unique_years
-        elif rank == 2:
-            for fd in formatted:
-                validator_data.append([real_name] + fd)
-        # rank=3 (РОП) игнорируем
-
-    update_hidden_data_sheet(all_data)
-
-    # Основная страница
-    all_months = set()
-    all_years = set()
-    for mm in manager_months.values():
-        all_months.update(mm)
-    for yv in manager_years.values():
-        all_years.update(yv)
-    update_main_sheet(manager_names, all_months, all_years)
-
-    # Валидаторы
-    update_validators_sheet(validator_data)
-
-    # Страницы менеджеров
-    for real_name in manager_names:
-        m_list = manager_months.get(real_name, [])
-        y_list = manager_years.get(real_name, [])
-        update_manager_sheet(real_name, m_list, y_list)
-        time.sleep(1)
+    В режиме 'formulas' листы считает Google Sheets по Data, достаточно стадии 'data';
+    в режиме 'materialized' (mode по умолчанию — EXPORT_MODE) готовые значения лежат
+    на самих листах, поэтому пересобирается и их содержимое.
+    """
+    if (mode or EXPORT_MODE) == 'materialized':
+        return CONTENT_STAGES
+    return DATA_STAGES
 
-    print("Обновление Google Sheet завершено.")
+def run_export(stages=ALL_STAGES, force=False, mode=None):
+    """
+    Единый планировщик экспорта в Google Sheets.
 
+    Выборка из БД строится один раз и только если она нужна выбранным стадиям:
+    'data' — скрытый лист Data, 'main' — «Основная страница», 'validators' —
+    «Валидаторы», 'managers' — листы менеджеров, 'formatting' — ширины колонок,
+    заморозка, границы. Стадия 'formatting' сама по себе БД не выгружает.
 
-async def update_user_data():
+    Returns:
+        dict: Отчёт sheets_metrics по вызовам API.
     """
-    Обновляем лист Data (скрытый), «Основная страница» (только для менеджеров rank=1),
-    индивидуальные листы менеджеров, и общий лист «Валидаторы» (rank=2).
-    """
-    print("Запущено обновление данных.")
-    from sqlalchemy.sql import func
-    user_ids = session.query(user_info_table.c.user_id).distinct().all()
-
-    all_data = []
-    manager_names = []
-    manager_months = {}
-    manager_years = {}
-    validator_data = []
-
-    for (u_id,) in user_ids:
-        real_name = get_user_name(u_id)
-        rank = get_user_rank(u_id)
-        if not real_name or rank is None:
-            continue
-        user_data = fetch_user_data(u_id)
-        formatted = format_data_for_sheet(user_data)
-        # Для Data:
-        for fd in formatted:
-            # fd = [month_ru, date_str, start_str, end_str, leads, photo]
-            all_data.append([real_name] + fd)
-
-        # Сортируем по рангу
-        if rank == 1:
-            # Менеджер
-            months = [r[0] for r in formatted]  # r[0] = month_ru
-            unique_months = sorted(set(months), key=lambda m: MONTHS_RU_ORDER.get(m, 0))
-            years_list = [r[1].split('/')[-1] for r in formatted]
-            unique_years = sorted(set(years_list))
-            manager_names.append(real_name)
-            manager_months[real_name] = unique_months
-            manager_years[real_name] = unique_years
-        elif rank == 2:
-            # Валидатор
-            for fd in formatted:
-                validator_data.append([real_name] + fd)
-        # rank=3 (РОП) не отображаем
-
-    # 1) Обновляем скрытый лист Data
-    update_hidden_data_sheet(all_data)
+    stages = set(stages)
+    unknown = stages - set(EXPORT_STAGES)
+    if unknown:
+        raise ValueError(f"Неизвестные стадии экспорта: {', '.join(sorted(unknown))}")
+    ordered = [stage for stage in EXPORT_STAGES if stage in stages]
+
+    print(f"Запущено обновление Google Sheet: {', '.join(ordered)}.")
+    sheets_metrics.start_run(f"export[{','.join(ordered)}]")
+    try:
+        extract = None
+        if stages & {'data', 'main', 'validators', 'managers'}:
+            extract = collect_export_data()
+        refresh_worksheet_index()
 
+        if 'data' in stages:
+            update_hidden_data_sheet(extract[0])
+
+        if stages & {'main', 'validators', 'managers', 'formatting'}:
+            # Неизменённые листы пропускаются по хешу шаблона
+            update_template_sheets(stages, extract, mode=mode, force=force)
+    finally:
+        # Структурированный отчёт по вызовам API (и сводка в лог-чат, если включена)
+        report = sheets_metrics.finish_run()
 
     print("Обновление Google Sheet завершено.")
+    return report
 
 async def update_all_data():
-    """
-    Обновляем лист Data (скрытый), «Основная страница» (только для менеджеров rank=1),
-    индивидуальные листы менеджеров, и общий лист «Валидаторы» (rank=2).
-    """
-    print("Запущено обновление данных.")
-    from sqlalchemy.sql import func
-    user_ids = session.query(user_info_table.c.user_id).distinct().all()
-
-    all_data = []
-    manager_names = []
-    manager_months = {}
-    manager_years = {}
-    validator_data = []
-
-    for (u_id,) in user_ids:
-        real_name = get_user_name(u_id)
-        rank = get_user_rank(u_id)
-        if not real_name or rank is None:
-            continue
-        user_data = fetch_user_data(u_id)
-        formatted = format_data_for_sheet(user_data)
-        # Для Data:
-        for fd in formatted:
-            # fd = [month_ru, date_str, start_str, end_str, leads, photo]
-            all_data.append([real_name] + fd)
-
-        # Сортируем по рангу
-        if rank == 1:
-            # Менеджер
-            months = [r[0] for r in formatted]  # r[0] = month_ru
-            unique_months = sorted(set(months), key=lambda m: MONTHS_RU_ORDER.get(m, 0))
-            years_list = [r[1].split('/')[-1] for r in formatted]
-            unique_years = sorted(set(years_list))
-            manager_names.append(real_name)
-            manager_months[real_name] = unique_months
-            manager_years[real_name] = unique_years
-        elif rank == 2:
-            # Валидатор
-            for fd in formatted:
-                validator_data.append([real_name] + fd)
-        # rank=3 (РОП) не отображаем
-
-    # 1) Обновляем скрытый лист Data
-    update_hidden_data_sheet(all_data)
-
-    # 2) Основная страница (только менеджеры)
-    all_months = set()
-    all_years = set()
-    for mm in manager_months.values():
-        all_months.update(mm)
-    for yv in manager_years.values():
-        all_years.update(yv)
-    update_main_sheet(manager_names, all_months, all_years)
-
-    # 4) Общая страница «Валидаторы»
-    update_validators_sheet(validator_data)
-
-    # 3) Страницы менеджеров
-    for real_name in manager_names:
-        m_list = manager_months.get(real_name, [])
-        y_list = manager_years.get(real_name, [])
-        update_manager_sheet(real_name, m_list, y_list)
-        time.sleep(1)
+    """Все стадии: Data, «Основная страница», «Валидаторы», листы менеджеров, форматирование."""
+    run_export(ALL_STAGES)
 
-    print("Обновление Google Sheet завершено.")
+async def update_user_data():
+    """Скрытый лист Data (и содержимое листов, если EXPORT_MODE = 'materialized')."""
+    run_export(data_change_stages())
 
 async def main():
     await update_all_data()
@@ -0,0 +1,219 @@
+# export_snapshot.py
+# Локальный снимок рабочих данных (user_info ⋈ names) для отчётов — без Google Sheets API.
+#
+# Записи раскладываются по партициям год/месяц (по user_info.date), отдельное дерево
+# на каждый формат, чтобы каталог читался как датасет (pd.read_parquet('snapshots/parquet')):
+#
+#   snapshots/parquet/year=2024/month=05/part.parquet
+#   snapshots/csv/year=2024/month=05/part.csv     (если SNAPSHOT_CSV)
+#   snapshots/_manifest.json                      хеши партиций прошлого прогона
+#
+# Выборка читается пачками по SNAPSHOT_CHUNK_ROWS строк в порядке date, и каждая
+# партиция записывается, как только прочитан её последний месяц — вся таблица
+# в память не загружается. Перезаписываются только партиции, у которых изменился
+# хеш содержимого; партиции, из которых пропали все записи, удаляются. Parquet
+# пишется через pyarrow — он необязателен: без него снимок сохраняется только в CSV.
+#
+#   python export_snapshot.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import pandas as pd
+from sqlalchemy import MetaData
+from sqlalchemy.sql import select
+
+from app.database.engine import engine
+
+try:
+    import pyarrow  # noqa: F401 — нужен pandas.DataFrame.to_parquet
+except ImportError:
+    pyarrow = None
+
+# Куда складывать снимок (переопределяется переменной окружения SNAPSHOT_DIR)
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR') or 'snapshots'
+# Писать ли рядом с Parquet ещё и CSV (без pyarrow CSV пишется всегда)
+SNAPSHOT_CSV = False
+SNAPSHOT_MANIFEST = '_manifest.json'
+SNAPSHOT_COLUMNS = ['user_id', 'real_name', 'rank', 'date', 'start_time', 'end_time', 'leads', 'has_photo']
+# Целые колонки — nullable Int64: один NULL не должен превращать колонку в float
+# и менять схему (и хеши) всех партиций
+SNAPSHOT_INT_COLUMNS = ['user_id', 'rank', 'leads', 'has_photo']
+# Сколько строк выборки для снимка читать за раз
+SNAPSHOT_CHUNK_ROWS = 20000
+
+# Таблицы отражаются здесь же, а не берутся из export_google: снимку не нужны
+# gspread и учётные данные Google
+metadata = MetaData()
+metadata.reflect(bind=engine, only=['names', 'user_info'])
+
+names_table = metadata.tables['names']
+user_info_table = metadata.tables['user_info']
+
+
+def iter_snapshot_frames(chunksize=SNAPSHOT_CHUNK_ROWS):
+    """
+    Выборка user_info ⋈ names для снимка, потоково — DataFrame по chunksize строк.
+
+    Строки упорядочены по date (затем user_id, id): записи одного месяца идут подряд,
+    а порядок внутри партиции стабилен, и хеш не меняется без изменения данных.
+    """
+    query = (
+        select(
+            user_info_table.c.user_id,
+            names_table.c.real_name,
+            names_table.c.rank,
+            user_info_table.c.date,
+            user_info_table.c.start_time,
+            user_info_table.c.end_time,
+            user_info_table.c.leads,
+            user_info_table.c.has_photo
+        )
+        .select_from(user_info_table.join(
+            names_table, names_table.c.real_user_id == user_info_table.c.user_id
+        ))
+        .order_by(user_info_table.c.date, user_info_table.c.user_id, user_info_table.c.id)
+        .execution_options(yield_per=chunksize)
+    )
+    with engine.connect() as conn:
+        for chunk in pd.read_sql(query, conn, parse_dates=['date', 'start_time', 'end_time'], chunksize=chunksize):
+            yield chunk[SNAPSHOT_COLUMNS].astype({column: 'Int64' for column in SNAPSHOT_INT_COLUMNS})
+
+
+def iter_snapshot_partitions(chunksize=SNAPSHOT_CHUNK_ROWS):
+    """
+    ((год, месяц), записи партиции) по user_info.date, по очереди.
+
+    Выборка упорядочена по date, поэтому партиция готова, как только начался
+    следующий месяц: в памяти держатся только текущий месяц и одна пачка строк.
+    """
+    key, pieces = None, []
+    for chunk in iter_snapshot_frames(chunksize):
+        chunk = chunk.dropna(subset=['date'])
+        for (year, month), part in chunk.groupby([chunk['date'].dt.year, chunk['date'].dt.month], sort=True):
+            if (int(year), int(month)) != key:
+                if pieces:
+                    yield key, pd.concat(pieces, ignore_index=True)
+                key, pieces = (int(year), int(month)), []
+            pieces.append(part)
+    if pieces:
+        yield key, pd.concat(pieces, ignore_index=True)
+
+
+def partition_path(root, fmt, year, month):
+    return os.path.join(root, fmt, f'year={year}', f'month={month:02d}', f'part.{fmt}')
+
+
+def partition_fingerprint(part):
+    """Хеш содержимого партиции: одинаковые записи дают одинаковый хеш."""
+    hashed = pd.util.hash_pandas_object(part, index=False).values
+    return hashlib.sha256(hashed.tobytes()).hexdigest()
+
+
+def load_manifest(root):
+    """{формат: {'2024-05': хеш}} партиций, записанных в прошлый раз."""
+    try:
+        with open(os.path.join(root, SNAPSHOT_MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(root, manifest):
+    path = os.path.join(root, SNAPSHOT_MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def snapshot_formats(csv=None):
+    """Форматы файлов партиции: Parquet, если есть pyarrow, и CSV — по SNAPSHOT_CSV или вместо Parquet."""
+    formats = ['parquet'] if pyarrow is not None else []
+    if (SNAPSHOT_CSV if csv is None else csv) or not formats:
+        formats.append('csv')
+    return formats
+
+
+def write_partition(path, part, fmt):
+    """Записать файл партиции через временный, чтобы читатели не видели половину файла."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == 'parquet':
+        part.to_parquet(path + '.tmp', index=False, engine='pyarrow')
+    else:
+        part.to_csv(path + '.tmp', index=False, date_format='%Y-%m-%d %H:%M:%S')
+    os.replace(path + '.tmp', path)
+
+
+def remove_partition(path):
+    """Удалить файл партиции и опустевшие каталоги month=/year=."""
+    if os.path.exists(path):
+        os.remove(path)
+    for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+
+
+def export_snapshot(root=None, csv=None, force=False):
+    """
+    Обновить локальный снимок рабочих данных.
+
+    Args:
+        root: Каталог снимка (по умолчанию SNAPSHOT_DIR).
+        csv: Писать ли CSV рядом с Parquet (по умолчанию SNAPSHOT_CSV).
+        force: Перезаписать все партиции, даже если хеш не изменился.
+
+    Returns:
+        dict: Итог прогона по форматам — записанные, пропущенные и удалённые партиции ('ГГГГ-ММ').
+    """
+    root = root or SNAPSHOT_DIR
+    formats = snapshot_formats(csv)
+    if pyarrow is None:
+        logging.warning("pyarrow не установлен — снимок пишется только в CSV, без Parquet.")
+
+    previous = load_manifest(root)
+    stored = {fmt: {} if force else previous.get(fmt, {}) for fmt in formats}
+    fingerprints = {}
+    result = {'root': root}
+    for fmt in formats:
+        result[fmt] = {'written': [], 'skipped': [], 'removed': []}
+
+    # Каждая партиция пишется во все форматы сразу, как только прочитана
+    for (year, month), part in iter_snapshot_partitions():
+        key = f'{year}-{month:02d}'
+        fingerprints[key] = partition_fingerprint(part)
+        for fmt in formats:
+            path = partition_path(root, fmt, year, month)
+            if stored[fmt].get(key) == fingerprints[key] and os.path.exists(path):
+                result[fmt]['skipped'].append(key)
+                continue
+            write_partition(path, part, fmt)
+            result[fmt]['written'].append(key)
+
+    manifest = {}
+    for fmt in formats:
+        for key in sorted(set(previous.get(fmt, {})) - set(fingerprints)):
+            year, month = map(int, key.split('-'))
+            remove_partition(partition_path(root, fmt, year, month))
+            result[fmt]['removed'].append(key)
+        manifest[fmt] = fingerprints
+        logging.info(f"Снимок данных {fmt} в {root}: записано партиций {len(result[fmt]['written'])}, "
+                     f"без изменений {len(result[fmt]['skipped'])}, удалено {len(result[fmt]['removed'])}.")
+
+    # Формат, который больше не пишется (например, CSV после отключения SNAPSHOT_CSV),
+    # удаляется целиком, чтобы в каталоге не оставались устаревшие данные
+    for fmt in set(previous) - set(formats):
+        shutil.rmtree(os.path.join(root, fmt), ignore_errors=True)
+        logging.info(f"Снимок данных {fmt} в {root} больше не ведётся и удалён.")
+
+    os.makedirs(root, exist_ok=True)
+    save_manifest(root, manifest)
+    return result
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(json.dumps(export_snapshot(), ensure_ascii=False, indent=2))
@@ -3,14 +3,19 @@ import asyncio
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand
 from aiogram.fsm.storage.memory import MemoryStorage
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 import uvicorn
 from contextlib import asynccontextmanager
+from typing import List
 
 from app.scheduler import check_scheduler_status  # Обновленный импорт
 from config import API_TOKEN
 from app.handlers import router
-from app.database.requests import update_leads_from_crm_async
+from app.database.requests import update_leads_from_crm_batch
+from app.ingestion import lead_ingestion
+from app.leads_buffer import lead_accumulator
+from app.lead_dedupe import lead_dedupe
+from app.sheets_sync import sheets_sync
 from app.database.models import LeadData
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -34,22 +39,115 @@ async def lifespan(appi: FastAPI):
     check_scheduler_status()  # Обновленный вызов функции
     await set_commands(bot)
     asyncio.create_task(dp.start_polling(bot))
+    lead_ingestion.start()
+    lead_accumulator.start()
     yield
-    # Код при завершении приложения (если нужно)
+    # Код при завершении приложения: разбираем очередь и дописываем накопленные лиды
+    await lead_ingestion.stop()
+    await lead_accumulator.stop()
+    lead_ingestion.shutdown()
 
 
 appi = FastAPI(lifespan=lifespan)
 
 
+def _queue_job(job):
+    """Поставить задачу в очередь приёма лидов; при переполнении — 429 с Retry-After."""
+    try:
+        return lead_ingestion.submit(job)
+    except asyncio.QueueFull:
+        raise HTTPException(
+            status_code=429,
+            detail="Lead ingestion queue is full",
+            headers={"Retry-After": str(lead_ingestion.retry_after)}
+        )
+
+
+async def _ingest_lead(lead_data: LeadData):
+    key = lead_data.idempotency_key
+    if key and not await lead_dedupe.claim(key):
+        logging.info(f'Повтор события {key} от CRM, пропускаем.')
+        return "duplicate"
+    # Лиды копятся в буфере и записываются в БД пакетами; ключ записывается вместе с ними
+    try:
+        user_id = await lead_accumulator.add_from_chat(lead_data.chat_id, lead_data.lead_count, event_key=key)
+    except Exception:
+        if key:
+            lead_dedupe.release(key)
+        raise
+    if user_id is None and key:
+        # Записывать нечего — снимаем резерв, иначе ключ висел бы в памяти
+        lead_dedupe.release(key)
+    return "success"
+
+
+async def _ingest_batch(leads: List[LeadData]):
+    fresh = []
+    try:
+        for lead in leads:
+            if lead.idempotency_key and not await lead_dedupe.claim(lead.idempotency_key):
+                continue
+            fresh.append(lead)
+
+        # Ключи пакета записываются в той же транзакции, что и лиды
+        applied = await lead_ingestion.run_in_executor(
+            update_leads_from_crm_batch, [(lead.chat_id, lead.lead_count) for lead in fresh],
+            [lead.idempotency_key for lead in fresh if lead.idempotency_key]
+        )
+    except Exception:
+        for lead in fresh:
+            if lead.idempotency_key:
+                lead_dedupe.release(lead.idempotency_key)
+        raise
+    lead_dedupe.confirm([lead.idempotency_key for lead in fresh if lead.idempotency_key])
+
+    # Собираем ответ в исходном порядке, повторы помечаем отдельно
+    applied_iter = iter(applied)
+    fresh_ids = {id(lead) for lead in fresh}
+    results = []
+    for lead in leads:
+        if id(lead) in fresh_ids:
+            results.append(next(applied_iter))
+        else:
+            results.append({"chat_id": lead.chat_id, "lead_count": lead.lead_count, "status": "duplicate",
+                            "user_id": None})
+    return results
+
+
 # Эндпоинт для получения данных
 @appi.post("/update_leads")
 async def update_leads(lead_data: LeadData):
     chat_id = lead_data.chat_id
     lead_count = lead_data.lead_count
     logging.info(f'Получены данные: chat_id={chat_id}, lead_count={lead_count}')
-    # Выполните нужные действия с данными (например, обновление базы данных)
-    await update_leads_from_crm_async(chat_id, lead_count)
-    return {"status": "success", "message": "Data received", "chat_id": chat_id, "lead_count": lead_count}
+    status = await _queue_job(lambda: _ingest_lead(lead_data))
+    if status == "duplicate":
+        return {"status": "duplicate", "message": "Already processed", "chat_id": chat_id, "lead_count": lead_count}
+    return {"status": "success", "message": "Data received", "chat_id": chat_id, "lead_count": lead_count,
+            "pending": lead_accumulator.pending_count}
+
+
+@appi.get("/update_leads/pending")
+async def update_leads_pending():
+    return {"pending": lead_accumulator.pending_count}
+
+
+@appi.get("/update_leads/stats")
+async def update_leads_stats():
+    return {"queue": lead_ingestion.stats(), "pending": lead_accumulator.pending_count}
+
+
+@appi.get("/export/status")
+async def export_status():
+    return sheets_sync.status()
+
+
+# Эндпоинт для пакетной загрузки лидов (одна транзакция на весь пакет)
+@appi.post("/update_leads/batch")
+async def update_leads_batch(leads: List[LeadData]):
+    logging.info(f'Получен пакет лидов: {len(leads)} событий')
+    results = await _queue_job(lambda: _ingest_batch(leads))
+    return {"status": "success", "message": "Batch received", "count": len(results), "results": results}
 
 
 if __name__ == '__main__':